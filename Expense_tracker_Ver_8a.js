@@ -15,15 +15,107 @@ class ExpenseTracker {
         // Bind event handlers
         this.expense_form.addEventListener('submit', this.handle_form_submit.bind(this));
         
-        // Load initial summary
+        // Load initial summary; epoch and version identify it for incremental refreshes
+        this.category_totals = {};
+        this.epoch = null;
+        this.version = null;
         this.load_summary();
         
-        // Set up periodic refresh (every 30 seconds)
-        setInterval(() => this.load_summary(), 30000);
+        // Set up periodic refresh (every 30 seconds) until the event stream takes over
+        this.refresh_timer = null;
+        this.start_polling();
+        this.connect_events();
+    }
+
+    // Poll for changes every 30 seconds
+    start_polling() {
+        if (this.refresh_timer === null) {
+            this.refresh_timer = setInterval(() => this.refresh(), 30000);
+        }
+    }
+
+    stop_polling() {
+        clearInterval(this.refresh_timer);
+        this.refresh_timer = null;
+    }
+
+    // Receive summary changes pushed by the tracker's HTTP server (python Expense_tracker_Ver_8a.py --serve)
+    connect_events() {
+        if (!window.EventSource || window.location.protocol === 'file:') {
+            return;
+        }
+        const events = new EventSource('events');
+        
+        events.addEventListener('open', () => {
+            // The server replays what was missed since the last event id, then pushes changes
+            this.stop_polling();
+        });
+        events.addEventListener('error', () => {
+            // EventSource reconnects by itself; poll in the meantime
+            this.start_polling();
+            if (events.readyState === EventSource.CLOSED) {
+                events.close();
+            }
+        });
+        for (const event_type of ['expense', 'totals', 'archived']) {
+            events.addEventListener(event_type, (event) => this.apply_change(JSON.parse(event.data)));
+        }
+        events.addEventListener('resync', () => this.load_summary());
+    }
+
+    // Fetch only the changes since the displayed version, falling back to the whole summary
+    async refresh() {
+        if (this.version === null) {
+            return this.load_summary();
+        }
+        try {
+            const response = await fetch(`changes?since=${this.version}&epoch=${this.epoch}`, { cache: 'no-store' });
+            const data = response.ok ? await response.json() : { reset: true };
+            if (data.reset) {
+                return this.load_summary();
+            }
+            data.changes.forEach(change => this.apply_change(change));
+        } catch (error) {
+            this.load_summary();
+        }
+    }
+
+    // Apply one versioned summary change, skipping any the display already includes
+    apply_change(change) {
+        if (change.epoch !== undefined && change.epoch !== this.epoch) {
+            // The tracker restarted, so versions start over
+            return this.load_summary();
+        }
+        if (this.version !== null && change.version <= this.version) {
+            return;
+        }
+        if (change.type === 'archived') {
+            // Archived expenses have to leave the list, so reload it
+            return this.load_summary();
+        }
+        if (change.type === 'expense') {
+            this.apply_expense_event(change);
+        } else {
+            this.apply_totals(change);
+        }
+        this.version = change.version;
+    }
+
+    // Add a pushed expense and the totals it changed to the display
+    apply_expense_event(change) {
+        this.expense_list.insertAdjacentHTML('afterbegin', this.create_expense_row(change.expense));
+        this.apply_totals(change);
+    }
+
+    // Update the total and the category totals present in a pushed change
+    apply_totals(change) {
+        this.total_amount_display.textContent = this.format_currency(change.total_amount);
+        Object.assign(this.category_totals, change.category_totals);
+        this.update_category_summary(this.category_totals);
     }
 
     // Handle form submission
-    handle_form_submit(event) {
+    async handle_form_submit(event) {
         event.preventDefault();
         
         const expense_data = {
@@ -33,13 +125,43 @@ class ExpenseTracker {
             date: new Date().toISOString()
         };
 
-        this.save_expense(expense_data);
         this.expense_form.reset();
+        if (await this.post_expense(expense_data)) {
+            // Saved by the tracker's HTTP server; the event stream (or this refresh) shows it
+            if (this.refresh_timer !== null) {
+                this.refresh();
+            }
+            return;
+        }
+
+        this.save_expense(expense_data);
         
         // Refresh summary after a brief delay to allow Python processing
         setTimeout(() => this.load_summary(), 1000);
     }
 
+    // Send expense data to the tracker's HTTP server (python Expense_tracker_Ver_8a.py --serve)
+    async post_expense(expense_data) {
+        try {
+            const response = await fetch('expenses', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(expense_data)
+            });
+            if (response.status === 404 || response.status === 405) {
+                // Served as plain files, fall back to the file download
+                return false;
+            }
+            const result = await response.json();
+            if (!result.saved) {
+                this.show_error_message(result.message);
+            }
+            return true;
+        } catch (error) {
+            return false;
+        }
+    }
+
     // Save expense data to file
     save_expense(expense_data) {
         const download_link = document.createElement('a');
@@ -58,7 +180,8 @@ class ExpenseTracker {
     // Load and display expense summary
     async load_summary() {
         try {
-            const response = await fetch('expense_summary.json');
+            // Revalidate with the server's ETag so an unchanged summary is not downloaded again
+            const response = await fetch('expense_summary.json', { cache: 'no-cache' });
             const data = await response.json();
             this.update_display(data);
         } catch (error) {
@@ -69,11 +192,16 @@ class ExpenseTracker {
 
     // Update the display with new data
     update_display(data) {
+        // Summaries written before versioning have neither
+        this.epoch = data.epoch ?? null;
+        this.version = data.version ?? null;
+        
         // Update total amount
         this.total_amount_display.textContent = this.format_currency(data.total_amount);
         
         // Update category summary
-        this.update_category_summary(data.category_totals);
+        this.category_totals = { ...data.category_totals };
+        this.update_category_summary(this.category_totals);
         
         // Update expense list
         this.update_expense_list(data.expenses);
@@ -1,189 +1,3494 @@
+import argparse
+import asyncio
+import functools
+import gzip
+import hashlib
+import itertools
 import json
+import math
 import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
 import time
-from datetime import datetime
+import uuid
+import weakref
+from array import array
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, errorcode, pooling
+from mysql.connector.errors import InterfaceError, OperationalError, PoolError, ProgrammingError
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    # Settings are then read from the environment only
+    load_dotenv = None
+
+try:
+    import numpy
+except ImportError:
+    # The in-memory summary falls back to a plain Python loop
+    numpy = None
+
+try:
+    import aiomysql
+except ImportError:
+    # Only needed for the asyncio database mode (--async-db with ASYNC_DB_DRIVER=aiomysql)
+    aiomysql = None
+
+try:
+    import aiosqlite
+except ImportError:
+    # Only needed for ASYNC_DB_DRIVER=aiosqlite, the stand-in for testing without MySQL
+    aiosqlite = None
+
+# Load database settings (DB_HOST, DB_NAME, DB_USER, ...) from a .env file
+if load_dotenv:
+    load_dotenv()
+
+# Fields of an expense as it is kept in memory, written to the summary and sent to clients
+EXPENSE_FIELDS = ('id', 'amount', 'category', 'description', 'date', 'user_id')
+
+class SummaryEngine:
+    """Keep running expense totals in memory so new expenses are applied as deltas
+    
+    Every change gets the next version number and is kept in a bounded, append-only
+    change log, so clients holding version N can ask for just the changes since N.
+    """
+    # Expense fields kept in the change log and sent to clients
+    CHANGE_EXPENSE_FIELDS = EXPENSE_FIELDS
+
+    def __init__(self, categories, change_log_size=1000):
+        self.lock = threading.Lock()
+        self.categories = set(categories)
+        self.total_amount = 0.0
+        self.category_totals = {category: 0.0 for category in self.categories}
+        self.expense_count = 0
+        self.last_reconciled = None
+        # Versions restart with each process; the epoch tells clients which run they belong to
+        self.epoch = format(time.time_ns(), 'x')
+        self.version = 0
+        self.changes = deque(maxlen=change_log_size)
+        # Called with each change while the lock is held, so they see changes in version order
+        self.listeners = []
+        # Saves between their commit and apply_expense, and whether a reconcile is reading totals
+        self.gate = threading.Condition()
+        self.writers = 0
+        self.waiting_writers = 0
+        self.reconciling = False
+
+    def begin_write(self):
+        """Hold off reconciles from before a save commits until end_write, once its expenses are applied"""
+        with self.gate:
+            self.waiting_writers += 1
+            while self.reconciling:
+                self.gate.wait()
+            self.waiting_writers -= 1
+            self.writers += 1
+
+    def end_write(self):
+        with self.gate:
+            self.writers -= 1
+            if not self.writers:
+                self.gate.notify_all()
+
+    def begin_reconcile(self):
+        """Wait for the saves in flight to be applied and hold off new ones until end_reconcile
+        
+        Without this an expense committed after the aggregate query but applied before
+        reset() would be wiped out, or one committed before it counted twice.
+        """
+        with self.gate:
+            # Saves held off by the previous reconcile go first, so back-to-back reconciles cannot starve them
+            while self.reconciling or self.waiting_writers:
+                self.gate.wait()
+            self.reconciling = True
+            while self.writers:
+                self.gate.wait()
+
+    def end_reconcile(self):
+        with self.gate:
+            self.reconciling = False
+            self.gate.notify_all()
+
+    @contextmanager
+    def writing(self):
+        self.begin_write()
+        try:
+            yield
+        finally:
+            self.end_write()
+
+    @contextmanager
+    def reconciling_totals(self):
+        self.begin_reconcile()
+        try:
+            yield
+        finally:
+            self.end_reconcile()
+
+    def record_change(self, change):
+        """Give a change the next version and append it to the log; caller holds self.lock"""
+        self.version += 1
+        change['version'] = self.version
+        self.changes.append(change)
+        for listener in self.listeners:
+            listener(change)
+        return change
+
+    def reset(self, total_amount, category_totals, expense_count):
+        """Replace the running totals with freshly aggregated values from the database"""
+        with self.lock:
+            self.total_amount = float(total_amount or 0)
+            self.category_totals = {category: 0.0 for category in self.categories}
+            for category, total in category_totals.items():
+                self.category_totals[category] = float(total or 0)
+            self.expense_count = int(expense_count or 0)
+            self.last_reconciled = time.monotonic()
+            self.record_change({
+                'type': 'totals',
+                'total_amount': self.total_amount,
+                'category_totals': dict(self.category_totals),
+                'expense_count': self.expense_count
+            })
+
+    def apply_expense(self, expense_data):
+        """Add a single validated expense to the running totals"""
+        amount = float(expense_data['amount'])
+        with self.lock:
+            self.total_amount += amount
+            category = expense_data['category']
+            self.category_totals[category] = self.category_totals.get(category, 0.0) + amount
+            self.expense_count += 1
+            # Only the totals this expense changed
+            self.record_change({
+                'type': 'expense',
+                'total_amount': self.total_amount,
+                'category_totals': {category: self.category_totals[category]},
+                'expense_count': self.expense_count,
+                'expense': {field: expense_data[field] for field in self.CHANGE_EXPENSE_FIELDS
+                            if expense_data.get(field) is not None}
+            })
+
+    def record_archived(self, archive_date, count):
+        """Log that expenses dated before archive_date were archived; a reconcile follows"""
+        with self.lock:
+            self.record_change({'type': 'archived', 'before': archive_date, 'count': count})
+
+    def changes_since(self, version):
+        """Return the changes made after version, or None if the log no longer reaches back that far"""
+        with self.lock:
+            if version == self.version:
+                return []
+            if version > self.version or not self.changes or self.changes[0]['version'] > version + 1:
+                return None
+            # Versions in the log are consecutive, so the offset is a subtraction
+            return list(itertools.islice(self.changes, version + 1 - self.changes[0]['version'], None))
+
+    def reconcile_due(self, interval):
+        """Check whether the totals should be re-read from the database"""
+        if self.last_reconciled is None:
+            return True
+        return interval > 0 and time.monotonic() - self.last_reconciled >= interval
+
+    def snapshot(self):
+        """Return a consistent copy of the current totals"""
+        with self.lock:
+            return {
+                'epoch': self.epoch,
+                'version': self.version,
+                'total_amount': self.total_amount,
+                'category_totals': dict(self.category_totals),
+                'expense_count': self.expense_count
+            }
+
+class CompactExpenseStore:
+    """Column-oriented expense storage used instead of one dict per row
+    
+    Amounts, ids and dates are kept in typed arrays and each category name is stored
+    once and referenced by a small integer. Iterates newest first like the deque it replaces.
+    """
+    MISSING = -(2 ** 63)
+    # Typed columns written to the snapshot as raw bytes, in this order
+    ARRAY_COLUMNS = ('id', 'user_id', 'amount', 'category', 'date')
+
+    def __init__(self, maxlen=None):
+        self.maxlen = maxlen
+        self.lock = threading.Lock()
+        self.category_names = []
+        self.category_codes = {}
+        # Oldest first, so new expenses are a cheap append at the end
+        self.columns = self.empty_columns()
+        # Rows passed to extend() are older than everything stored and arrive newest first
+        self.older_columns = self.empty_columns()
+
+    def empty_columns(self):
+        """Create one empty typed column per stored field"""
+        return {
+            'id': array('q'),
+            'user_id': array('q'),
+            'amount': array('d'),
+            'category': array('H'),
+            'date': array('q'),
+            'description': []
+        }
+
+    def category_code(self, category):
+        """Return the integer standing in for a category name, adding it if new"""
+        code = self.category_codes.get(category)
+        if code is None:
+            code = len(self.category_names)
+            self.category_names.append(category)
+            self.category_codes[category] = code
+        return code
+
+    def append_row(self, columns, expense_data):
+        """Append one expense dict to a set of columns"""
+        expense_id = expense_data.get('id')
+        user_id = expense_data.get('user_id')
+        columns['id'].append(self.MISSING if expense_id is None else int(expense_id))
+        columns['user_id'].append(self.MISSING if user_id is None else int(user_id))
+        columns['amount'].append(float(expense_data['amount']))
+        columns['category'].append(self.category_code(expense_data['category']))
+        columns['date'].append(self.date_to_timestamp(expense_data.get('date')))
+        columns['description'].append(expense_data.get('description', ''))
+
+    @staticmethod
+    def date_to_timestamp(value):
+        """Convert a datetime, date or ISO string to whole UTC seconds"""
+        if isinstance(value, str):
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError:
+                return CompactExpenseStore.MISSING
+        if isinstance(value, datetime):
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            return int(value.timestamp())
+        if value is not None and hasattr(value, 'toordinal'):
+            return int(datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp())
+        return CompactExpenseStore.MISSING
+
+    def appendleft(self, expense_data):
+        """Add the newest expense, dropping the oldest ones once maxlen is exceeded"""
+        with self.lock:
+            self.merge_older()
+            self.append_row(self.columns, expense_data)
+            if self.maxlen:
+                # Trim in chunks so deleting from the front of the arrays stays rare
+                excess = len(self.columns['amount']) - self.maxlen
+                if excess > max(1024, self.maxlen // 4):
+                    for column in self.columns.values():
+                        del column[:excess]
+
+    def extend(self, expense_rows):
+        """Add rows older than everything stored, given newest first as load_expenses reads them"""
+        with self.lock:
+            for expense_data in expense_rows:
+                self.append_row(self.older_columns, expense_data)
+
+    def merge_older(self):
+        """Move rows added with extend() in front of the stored rows; caller holds self.lock"""
+        if not self.older_columns['amount']:
+            return
+        for name, column in self.columns.items():
+            older = self.older_columns[name]
+            older.reverse()
+            older.extend(column)
+            self.columns[name] = older
+        self.older_columns = self.empty_columns()
+
+    def trim_older_than(self, timestamp):
+        """Drop the oldest rows until the oldest left is dated at or after timestamp"""
+        with self.lock:
+            self.merge_older()
+            dates = self.columns['date']
+            excess = 0
+            while excess < len(dates) and dates[excess] < timestamp:
+                excess += 1
+            if excess:
+                for column in self.columns.values():
+                    del column[:excess]
+
+    def remove_older_than(self, timestamp):
+        """Drop every row dated before timestamp, including backdated rows among newer ones"""
+        with self.lock:
+            self.merge_older()
+            dates = self.columns['date']
+            kept = [index for index, value in enumerate(dates) if value >= timestamp]
+            if len(kept) == len(dates):
+                return
+            for name, column in self.columns.items():
+                kept_values = [column[index] for index in kept]
+                self.columns[name] = array(column.typecode, kept_values) if isinstance(column, array) else kept_values
+
+    def snapshot_columns(self):
+        """Return the stored rows as JSON-safe data plus the raw bytes of the typed columns"""
+        with self.lock:
+            self.merge_older()
+            data = {
+                'category_names': list(self.category_names),
+                'description': list(self.columns['description']),
+                'byteorder': sys.byteorder,
+                'itemsizes': {name: self.columns[name].itemsize for name in self.ARRAY_COLUMNS}
+            }
+            payload = b''.join(self.columns[name].tobytes() for name in self.ARRAY_COLUMNS)
+        return data, payload
+
+    def restore_columns(self, data, payload):
+        """Replace the stored rows with ones from snapshot_columns, raising ValueError if they do not fit"""
+        descriptions = data['description']
+        category_names = data['category_names']
+        if not all(isinstance(value, str) for value in itertools.chain(descriptions, category_names)):
+            raise ValueError("descriptions and category names must be strings")
+        if data['byteorder'] != sys.byteorder:
+            raise ValueError("written on a machine with a different byte order")
+
+        columns = self.empty_columns()
+        row_count = len(descriptions)
+        payload = memoryview(payload)
+        offset = 0
+        for name in self.ARRAY_COLUMNS:
+            column = columns[name]
+            size = row_count * column.itemsize
+            if data['itemsizes'][name] != column.itemsize or offset + size > len(payload):
+                raise ValueError(f"the {name} column does not match the stored rows")
+            column.frombytes(payload[offset:offset + size])
+            offset += size
+        if offset != len(payload) or (columns['category'] and max(columns['category']) >= len(category_names)):
+            raise ValueError("the columns do not match the stored rows")
+        columns['description'] = list(descriptions)
+
+        with self.lock:
+            self.category_names = list(category_names)
+            self.category_codes = {category: code for code, category in enumerate(self.category_names)}
+            self.columns = columns
+            self.older_columns = self.empty_columns()
+
+    def column_views(self):
+        """Return the newest maxlen rows of every column, oldest first"""
+        with self.lock:
+            self.merge_older()
+            start = 0
+            if self.maxlen:
+                start = max(0, len(self.columns['amount']) - self.maxlen)
+            return {name: column[start:] for name, column in self.columns.items()}
+
+    def row(self, columns, index):
+        """Rebuild the dict for one stored expense"""
+        expense_data = {
+            'amount': columns['amount'][index],
+            'category': self.category_names[columns['category'][index]],
+            'description': columns['description'][index],
+            'date': None
+        }
+        timestamp = columns['date'][index]
+        if timestamp != self.MISSING:
+            expense_data['date'] = datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+        if columns['id'][index] != self.MISSING:
+            expense_data['id'] = columns['id'][index]
+        if columns['user_id'][index] != self.MISSING:
+            expense_data['user_id'] = columns['user_id'][index]
+        return expense_data
+
+    def __len__(self):
+        with self.lock:
+            stored = len(self.columns['amount']) + len(self.older_columns['amount'])
+        return min(stored, self.maxlen) if self.maxlen else stored
+
+    def __iter__(self):
+        columns = self.column_views()
+        return (self.row(columns, index) for index in range(len(columns['amount']) - 1, -1, -1))
+
+class SummaryScheduler:
+    """Regenerate the summary file at most once per interval, however many expenses arrive"""
+    def __init__(self, expense_tracker, interval):
+        self.expense_tracker = expense_tracker
+        self.interval = interval
+        self.dirty = False
+        self.stopping = False
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="summary-scheduler", daemon=True)
+        self.thread.start()
+
+    def mark_dirty(self):
+        """Note that the summary is out of date; the next write picks up every change so far"""
+        self.dirty = True
+        self.wakeup.set()
+
+    def run(self):
+        """Write the summary whenever it is dirty, then rest for the interval"""
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            if self.dirty:
+                self.dirty = False
+                self.expense_tracker.update_summary()
+            if self.stopping:
+                return
+            # Changes made during the pause are coalesced into the next write
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        """Write any pending changes and stop the scheduler thread"""
+        self.stopping = True
+        self.stop_event.set()
+        self.wakeup.set()
+        self.thread.join()
+
+class DatabaseReconnector:
+    """Retry the connection pool on a background thread after the database was unreachable at startup
+
+    Without it only a spool replay reconnected, so with EXPENSE_SPOOL=0 or no new expenses the tracker stayed offline.
+    """
+    def __init__(self, expense_tracker, interval):
+        self.expense_tracker = expense_tracker
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="database-reconnector", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Try again once every interval until a pool exists, whoever created it"""
+        while not self.stop_event.wait(self.interval):
+            if self.expense_tracker.reconnect_database():
+                return
+
+    def stop(self):
+        """Give up retrying"""
+        self.stop_event.set()
+        self.thread.join()
+
+class ArchiveScheduler:
+    """Archive old expenses periodically on a background thread, off the ingest path"""
+    def __init__(self, expense_tracker, interval, retention_days, run_at_startup=True):
+        self.expense_tracker = expense_tracker
+        self.interval = interval
+        self.retention_days = retention_days
+        self.run_at_startup = run_at_startup
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="archive-scheduler", daemon=True)
+
+    def start(self):
+        """Start the schedule without waiting for the first run"""
+        self.thread.start()
+
+    def run(self):
+        """Archive straight away (unless skipped) and then once every interval"""
+        if not self.run_at_startup and self.interval <= 0:
+            return
+        delay = 0 if self.run_at_startup else self.interval
+        while not self.stop_event.wait(delay):
+            if self.expense_tracker.partitioning:
+                self.expense_tracker.ensure_partitions()
+            archive_threshold = datetime.now() - timedelta(days=self.retention_days)
+            self.expense_tracker.archive_old_expenses(archive_threshold, stop_event=self.stop_event)
+            if self.interval <= 0:
+                return
+            delay = self.interval
+
+    def stop(self):
+        """Stop after the batch in progress; the next run carries on from there"""
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+class SummaryEventBus:
+    """Fan summary changes out from the ingest threads to the HTTP event streams
+    
+    Each subscriber is a bounded asyncio queue on its own event loop. A subscriber
+    that falls behind is sent a single 'resync' event instead of an unbounded backlog.
+    """
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.subscribers = set()
+
+    def subscribe(self):
+        """Register a queue on the running event loop and return it"""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(self.queue_size))
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def has_subscribers(self):
+        return bool(self.subscribers)
+
+    def publish(self, event_type, data):
+        """Queue an event for every subscriber; safe to call from any thread"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for loop, events in subscribers:
+            try:
+                loop.call_soon_threadsafe(self.deliver, events, (event_type, data))
+            except RuntimeError:
+                # The subscriber's loop has already closed
+                self.unsubscribe((loop, events))
+
+    @staticmethod
+    def deliver(events, event):
+        """Put an event on a subscriber queue; runs on the subscriber's loop"""
+        try:
+            events.put_nowait(event)
+        except asyncio.QueueFull:
+            while not events.empty():
+                events.get_nowait()
+            events.put_nowait(('resync', {}))
+
+# save_expenses reports this when the database could not be reached at all
+DATABASE_UNAVAILABLE = "Database unavailable"
+# store_expenses reports this for expenses written to the spool instead of the database
+SPOOLED = "Queued in the spool until the database is available"
+
+def is_connection_error(error):
+    """Check whether a database error means the server could not be reached or went away
+    
+    mysql.connector raises InterfaceError or OperationalError for those; a busy pool
+    (PoolError) or a rejected statement does not make the database unavailable.
+    """
+    return isinstance(error, (InterfaceError, OperationalError))
+
+class ExpenseSpool:
+    """Append-only, fsync'd log of expenses accepted while the database is unavailable
+    
+    A background thread replays the log into the database in batches once it is reachable again.
+    The log is moved aside before each replay, so new expenses keep appending while it runs.
+    """
+    def __init__(self, expense_tracker, path, interval, batch_size):
+        self.expense_tracker = expense_tracker
+        self.path = path
+        self.replay_path = f"{path}.replay"
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.spool_file = open(path, 'a', encoding='utf-8')
+        # Expenses left behind by a previous run are replayed first
+        self.backlog = self.spool_file.tell() > 0 or os.path.exists(self.replay_path)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="expense-spool", daemon=True)
+        self.thread.start()
+
+    def has_backlog(self):
+        """Check whether spooled expenses are still waiting for the database"""
+        return self.backlog
+
+    def append(self, records):
+        """Durably append validated expenses, returning False if they could not be written"""
+        lines = ''.join(json.dumps(record, default=json_default) + '\n' for record in records)
+        with self.lock:
+            try:
+                self.spool_file.write(lines)
+                self.spool_file.flush()
+                # One fsync per batch; the expenses are only acknowledged once it returns
+                os.fsync(self.spool_file.fileno())
+            except OSError as e:
+                print(f"Error writing to the expense spool: {e}")
+                return False
+            self.backlog = True
+        return True
+
+    def run(self):
+        """Try to drain the spool once every interval"""
+        while not self.stop_event.wait(self.interval):
+            if self.backlog:
+                self.replay()
+
+    def rotate(self):
+        """Move the spooled expenses aside for replay, returning False if there are none"""
+        with self.lock:
+            if os.path.exists(self.replay_path):
+                # An earlier replay did not finish; carry on with it first
+                return True
+            if self.spool_file.tell() == 0:
+                return False
+            self.spool_file.close()
+            os.replace(self.path, self.replay_path)
+            self.spool_file = open(self.path, 'a', encoding='utf-8')
+            return True
+
+    def read_records(self, path):
+        """Yield the spooled expenses in the order they were accepted"""
+        with open(path, encoding='utf-8') as spool_file:
+            for line in spool_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line torn by a crash mid-append; its batch was never acknowledged
+                    continue
+                # Spooled with a +00:00 offset, or without one by earlier versions
+                record['date'] = naive_utc(datetime.fromisoformat(record['date']))
+                yield record
+
+    def replay(self):
+        """Save the spooled expenses in batches, stopping as soon as the database is unreachable
+        
+        Expenses saved before an interrupted replay are rejected by the dedup index when it is retried.
+        """
+        expense_tracker = self.expense_tracker
+        if not expense_tracker.db_pool and not expense_tracker.reconnect_database():
+            return
+        if not self.rotate():
+            with self.lock:
+                self.backlog = self.spool_file.tell() > 0
+            return
+
+        replayed = 0
+        records = self.read_records(self.replay_path)
+        try:
+            while True:
+                batch = list(itertools.islice(records, self.batch_size))
+                if not batch:
+                    break
+                with expense_tracker.summary_engine.writing():
+                    errors = expense_tracker.save_expenses(batch)
+                    for expense_data, error_message in zip(batch, errors):
+                        if error_message is None:
+                            expense_tracker.apply_saved_expense(expense_data)
+                            replayed += 1
+                        elif error_message not in (DATABASE_UNAVAILABLE, VALIDATION_ERRORS['duplicate']):
+                            print(f"Error replaying spooled expense: {error_message}")
+                if DATABASE_UNAVAILABLE in errors:
+                    return
+        finally:
+            records.close()
+            if replayed:
+                print(f"Replayed {replayed} spooled expenses into the database")
+                expense_tracker.request_summary_update()
+
+        os.remove(self.replay_path)
+        with self.lock:
+            self.backlog = self.spool_file.tell() > 0
+
+    def stop(self):
+        """Stop the flusher, make a last attempt to drain the spool and close the log"""
+        self.stop_event.set()
+        self.thread.join()
+        if self.backlog:
+            self.replay()
+        with self.lock:
+            self.spool_file.close()
+
+def expense_columns(expense_list):
+    """Return (columns, category_names) for a CompactExpenseStore or any iterable of expense dicts"""
+    if not isinstance(expense_list, CompactExpenseStore):
+        store = CompactExpenseStore()
+        store.extend(expense_list)
+        expense_list = store
+    return expense_list.column_views(), list(expense_list.category_names)
+
+def summarize_expense_columns(columns, category_names, use_numpy=True):
+    """Compute totals, per-category sums and counts, and per-month and per-user totals in one pass"""
+    missing = CompactExpenseStore.MISSING
+    if use_numpy and numpy is not None:
+        # Wrap the typed arrays without copying them
+        amounts = numpy.frombuffer(columns['amount'], dtype=numpy.float64)
+        categories = numpy.frombuffer(columns['category'], dtype=numpy.uint16)
+        dates = numpy.frombuffer(columns['date'], dtype=numpy.int64)
+        user_ids = numpy.frombuffer(columns['user_id'], dtype=numpy.int64)
+
+        category_sums = numpy.bincount(categories, weights=amounts, minlength=len(category_names))
+        category_counts = numpy.bincount(categories, minlength=len(category_names))
+
+        dated = dates != missing
+        months, month_index = numpy.unique(dates[dated].astype('datetime64[s]').astype('datetime64[M]'),
+                                           return_inverse=True)
+        month_sums = numpy.bincount(month_index, weights=amounts[dated], minlength=len(months))
+
+        has_user = user_ids != missing
+        users, user_index = numpy.unique(user_ids[has_user], return_inverse=True)
+        user_sums = numpy.bincount(user_index, weights=amounts[has_user], minlength=len(users))
+
+        return {
+            'total_amount': float(amounts.sum()),
+            'expense_count': int(len(amounts)),
+            'category_totals': {name: float(category_sums[code]) for code, name in enumerate(category_names)},
+            'category_counts': {name: int(category_counts[code]) for code, name in enumerate(category_names)},
+            'monthly_totals': {str(month): float(total) for month, total in zip(months, month_sums)},
+            'user_totals': {str(user_id): float(total) for user_id, total in zip(users, user_sums)}
+        }
+
+    total_amount = 0.0
+    category_sums = [0.0] * len(category_names)
+    category_counts = [0] * len(category_names)
+    monthly_totals = {}
+    user_totals = {}
+    month_for_day = {}
+    for amount, code, timestamp, user_id in zip(columns['amount'], columns['category'],
+                                                columns['date'], columns['user_id']):
+        total_amount += amount
+        category_sums[code] += amount
+        category_counts[code] += 1
+        if timestamp != missing:
+            # Many expenses share a day, so only format each day's month once
+            day = timestamp // 86400
+            month = month_for_day.get(day)
+            if month is None:
+                month = datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m')
+                month_for_day[day] = month
+            monthly_totals[month] = monthly_totals.get(month, 0.0) + amount
+        if user_id != missing:
+            user_totals[str(user_id)] = user_totals.get(str(user_id), 0.0) + amount
+
+    return {
+        'total_amount': total_amount,
+        'expense_count': len(columns['amount']),
+        'category_totals': dict(zip(category_names, category_sums)),
+        'category_counts': dict(zip(category_names, category_counts)),
+        'monthly_totals': dict(sorted(monthly_totals.items())),
+        'user_totals': user_totals
+    }
+
+# Error codes returned by ExpenseTracker.validate_expenses and the message shown for each
+VALIDATION_ERRORS = {
+    'not_an_object': "Expense must be a JSON object",
+    'missing_amount': "Missing required field: 'amount'",
+    'missing_category': "Missing required field: 'category'",
+    'missing_description': "Missing required field: 'description'",
+    'missing_date': "Missing required field: 'date'",
+    'invalid_amount': "Amount must be positive",
+    'invalid_category': "Invalid category",
+    'empty_description': "Description cannot be empty",
+    'invalid_date': "Date must be an ISO 8601 date or datetime",
+    'invalid_user_id': "User id must be a positive integer",
+    'duplicate': "Duplicate expense, it has already been saved"
+}
+
+def expense_dedup_key(client_id, source, amount, category, description, expense_date, user_id):
+    """Hash the client-supplied id, or the source record and its content, into a 64 char key
+    
+    Returns None when there is neither: two identical expenses from a client that sends no ids are both kept.
+    """
+    if client_id:
+        key = f"client:{client_id}"
+    elif source:
+        key = f"{source}|{amount!r}|{category}|{description}|{expense_date.isoformat()}|{user_id}"
+    else:
+        return None
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def file_source(path):
+    """Identify a file by inode and modification time, which survive the renames that claim it"""
+    stat = os.stat(path)
+    return f"file:{stat.st_dev}:{stat.st_ino}:{stat.st_mtime_ns}"
+
+def batch_ids_query(expense_batch, first_id):
+    """Build the query reading back the ids of a multi-row INSERT by dedup_key, or None if an expense has none"""
+    dedup_keys = [expense_data.get('dedup_key') for expense_data in expense_batch]
+    if not all(dedup_keys):
+        return None
+    placeholders = ', '.join(['%s'] * len(dedup_keys))
+    # A partitioned table only keys on (dedup_key, date); the earliest match from first_id on is this batch's
+    return (f"SELECT dedup_key, id FROM expenses WHERE id >= %s AND dedup_key IN ({placeholders}) ORDER BY id",
+            [first_id, *dedup_keys])
+
+def assign_batch_ids(expense_batch, first_id, id_rows=None, id_step=1):
+    """Give each expense of a multi-row INSERT the id of its row
+    
+    id_rows are the (dedup_key, id) rows read back with batch_ids_query. Without them the ids are
+    counted from first_id in steps of auto_increment_increment, which multi-primary setups raise above 1.
+    """
+    if id_rows is None:
+        for offset, expense_data in enumerate(expense_batch):
+            expense_data['id'] = first_id + offset * id_step
+        return
+    row_ids = {}
+    for dedup_key, row_id in id_rows:
+        row_ids.setdefault(dedup_key, row_id)
+    for expense_data in expense_batch:
+        expense_data['id'] = row_ids[expense_data['dedup_key']]
+
+class DedupCache:
+    """Bounded LRU of recently saved dedup keys, so repeats are rejected without a database query"""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.keys = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.keys:
+                self.keys.move_to_end(key)
+                return True
+            return False
+
+    def add(self, key):
+        """Remember a saved key, forgetting the least recently seen one when full"""
+        with self.lock:
+            self.keys[key] = None
+            self.keys.move_to_end(key)
+            if len(self.keys) > self.capacity:
+                self.keys.popitem(last=False)
+
+class CategoryCache:
+    """In-memory copy of the categories table mapping names to category_id"""
+    def __init__(self, expense_tracker, ttl, miss_refresh_interval):
+        self.expense_tracker = expense_tracker
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self.ids_by_name = {}
+        self.names_by_id = {}
+        self.loaded_at = None
+        self.last_miss_refresh = 0.0
+
+    def refresh(self):
+        """Reload every category from the database"""
+        if not self.expense_tracker.db_pool:
+            return False
+        try:
+            with self.expense_tracker.database_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT category_id, name FROM categories")
+                rows = cursor.fetchall()
+                cursor.close()
+        except Error as e:
+            print(f"Error loading categories: {e}")
+            return False
+        self.load_rows(rows)
+        return True
+
+    def load_rows(self, rows):
+        """Replace the cache with (category_id, name) rows read from the categories table"""
+        # Swap in whole new dicts so readers on other threads never see a half-built map
+        self.ids_by_name = {name: category_id for category_id, name in rows}
+        self.names_by_id = {category_id: name for category_id, name in rows}
+        self.loaded_at = time.monotonic()
+
+    def current(self):
+        """Return the name to id map, reloading it first if the TTL has passed"""
+        if self.loaded_at is None or time.monotonic() - self.loaded_at >= self.ttl:
+            self.refresh()
+        return self.ids_by_name
+
+    def is_loaded(self):
+        """Check whether the categories table has been read at least once"""
+        return self.loaded_at is not None
+
+    def category_id(self, name):
+        """Look up a category id, reloading when the cache is stale or the name is unknown"""
+        now = time.monotonic()
+        if self.loaded_at is None or now - self.loaded_at >= self.ttl:
+            self.refresh()
+        category_id = self.ids_by_name.get(name)
+        if category_id is None and now - self.last_miss_refresh >= self.miss_refresh_interval:
+            # The category may have been added since the last load; limit how often a miss reloads
+            self.last_miss_refresh = now
+            if self.refresh():
+                category_id = self.ids_by_name.get(name)
+        return category_id
+
+    def category_name(self, category_id):
+        """Look up the name for a category id"""
+        return self.names_by_id.get(category_id)
+
+def month_start(value):
+    """Return the first day of the month containing a date or datetime"""
+    return date(value.year, value.month, 1)
+
+def add_months(month, count):
+    """Move a first-of-month date forward by count months"""
+    month_index = month.year * 12 + month.month - 1 + count
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def partition_name(month):
+    """Name of the monthly expenses partition holding the given month, e.g. p202401"""
+    return f"p{month.year:04d}{month.month:02d}"
+
+def partition_month(name):
+    """First day of the month held by a partition named by partition_name()"""
+    return date(int(name[1:5]), int(name[5:7]), 1)
+
+def partition_definitions(first_month, last_month):
+    """RANGE COLUMNS partition clauses for every month from first_month to last_month"""
+    definitions = []
+    month = first_month
+    while month <= last_month:
+        upper_bound = add_months(month, 1)
+        definitions.append(f"PARTITION {partition_name(month)} VALUES LESS THAN ('{upper_bound.isoformat()}')")
+        month = upper_bound
+    return definitions
+
+# Tables for the embedded SQLite backend, matching the columns of the MySQL schema.
+# AUTOINCREMENT keeps ids of archived rows from being handed out again.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS categories (
+    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(50) NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS expenses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    amount DECIMAL(10, 2) NOT NULL,
+    category_id INTEGER NOT NULL REFERENCES categories (category_id),
+    description VARCHAR(255) NOT NULL,
+    date DATETIME NOT NULL,
+    dedup_key CHAR(64) UNIQUE,
+    user_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS expenses_date ON expenses (date, id);
+CREATE TABLE IF NOT EXISTS archived_expenses (
+    id INTEGER PRIMARY KEY,
+    expense_id INTEGER UNIQUE,
+    amount DECIMAL(10, 2) NOT NULL,
+    category_id INTEGER NOT NULL,
+    description VARCHAR(255) NOT NULL,
+    date DATETIME NOT NULL,
+    user_id INTEGER
+);
+"""
+
+# sqlite3 errors that mean the database file cannot be used right now, rather than a bad statement
+SQLITE_UNAVAILABLE_ERRORS = ('database is locked', 'unable to open database file', 'disk I/O error')
+
+def sqlite_error(error):
+    """Turn a sqlite3 error into the mysql.connector Error the tracker already handles"""
+    if isinstance(error, sqlite3.IntegrityError) and 'UNIQUE' in str(error):
+        return Error(msg=str(error), errno=errorcode.ER_DUP_ENTRY)
+    if isinstance(error, sqlite3.OperationalError) and str(error).startswith(SQLITE_UNAVAILABLE_ERRORS):
+        # Treated like a lost MySQL server: the expenses are spooled and retried
+        return OperationalError(msg=str(error))
+    return Error(msg=str(error))
+
+def sqlite_value(value):
+    """Convert a query parameter to a type sqlite3 stores the way MySQL would"""
+    if isinstance(value, datetime):
+        # Same text layout as MySQL DATETIME, so dates compare and sort as strings
+        return value.isoformat(' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+# DATETIME columns come back as datetimes, like from MySQL; registered once, for every connection
+sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode()))
+
+class SQLiteCursor:
+    """The parts of a mysql.connector cursor the tracker uses, over a sqlite3 cursor"""
+    def __init__(self, cursor, dictionary=False):
+        self.cursor = cursor
+        self.dictionary = dictionary
+        self.first_row_id = None
+
+    def execute(self, query, params=()):
+        self.first_row_id = None
+        try:
+            self.cursor.execute(query.replace('%s', '?'), [sqlite_value(value) for value in params])
+        except sqlite3.Error as e:
+            raise sqlite_error(e) from e
+
+    def executemany(self, query, rows):
+        self.first_row_id = None
+        try:
+            self.cursor.executemany(query.replace('%s', '?'),
+                                    ([sqlite_value(value) for value in row] for row in rows))
+            if self.cursor.rowcount > 0:
+                # mysql.connector reports the first id of a multi-row INSERT; sqlite3 leaves lastrowid
+                # alone after executemany, but one writer at a time means the ids are consecutive
+                last_row_id, = self.cursor.connection.execute("SELECT last_insert_rowid()").fetchone()
+                self.first_row_id = last_row_id - self.cursor.rowcount + 1
+        except sqlite3.Error as e:
+            raise sqlite_error(e) from e
+
+    def make_row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return dict(zip((column[0] for column in self.cursor.description), row))
+
+    def fetchone(self):
+        return self.make_row(self.cursor.fetchone())
+
+    def fetchall(self):
+        return [self.make_row(row) for row in self.cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid if self.first_row_id is None else self.first_row_id
+
+    def close(self):
+        self.cursor.close()
+
+class SQLiteConnection:
+    """A pooled sqlite3 connection with the mysql.connector methods the tracker calls"""
+    def __init__(self, pool, connection):
+        self.pool = pool
+        self.connection = connection
+
+    def cursor(self, dictionary=False, prepared=False):
+        # sqlite3 keeps its own per-connection cache of compiled statements, so prepared is a no-op
+        return SQLiteCursor(self.connection.cursor(), dictionary)
+
+    def start_transaction(self):
+        # Fail like mysql.connector does, so a transaction left open is noticed on SQLite too
+        if self.connection.in_transaction:
+            raise ProgrammingError(msg="Transaction already in progress")
+        self.connection.execute("BEGIN")
+
+    @property
+    def in_transaction(self):
+        return self.connection.in_transaction
+
+    def commit(self):
+        try:
+            self.connection.commit()
+        except sqlite3.Error as e:
+            raise sqlite_error(e) from e
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        # The database is a local file, there is no server to lose
+        pass
+
+    def close(self):
+        """Hand the connection back to the pool, discarding anything left uncommitted"""
+        if self.connection.in_transaction:
+            self.connection.rollback()
+        self.pool.idle_connections.put(self)
+
+class SQLiteConnectionPool:
+    """Embedded SQLite database behind the same pool interface as mysql.connector.pooling
+    
+    Connections run in WAL mode so readers never block the writer, and wait up to
+    SQLITE_BUSY_TIMEOUT seconds for another writer's transaction instead of failing.
+    """
+    def __init__(self, path, pool_size, busy_timeout=5.0, synchronous='FULL'):
+        self.path = path
+        self.idle_connections = queue.Queue()
+        try:
+            for _ in range(pool_size):
+                connection = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False,
+                                             detect_types=sqlite3.PARSE_DECLTYPES)
+                connection.execute("PRAGMA journal_mode=WAL")
+                # FULL syncs the WAL on every commit; NORMAL only at checkpoints, so a power cut
+                # can lose commits that were already acknowledged
+                connection.execute(f"PRAGMA synchronous={synchronous}")
+                connection.execute("PRAGMA foreign_keys=ON")
+                self.idle_connections.put(SQLiteConnection(self, connection))
+        except sqlite3.Error as e:
+            raise sqlite_error(e) from e
+
+    def get_connection(self):
+        try:
+            return self.idle_connections.get_nowait()
+        except queue.Empty:
+            raise PoolError("Failed getting connection; pool exhausted") from None
+
+    def create_schema(self, categories):
+        """Create the tables if they are missing and add any missing categories"""
+        connection = self.get_connection()
+        try:
+            connection.connection.executescript(SQLITE_SCHEMA)
+            for table_name in ('expenses', 'archived_expenses'):
+                # Files created before user_id was stored
+                columns = {row[1] for row in connection.connection.execute(f"PRAGMA table_info({table_name})")}
+                if 'user_id' not in columns:
+                    connection.connection.execute(f"ALTER TABLE {table_name} ADD COLUMN user_id INTEGER")
+                if table_name == 'archived_expenses' and 'expense_id' not in columns:
+                    # Files from before expense_id kept the expense id in id
+                    connection.connection.execute("ALTER TABLE archived_expenses ADD COLUMN expense_id INTEGER")
+                    connection.connection.execute("UPDATE archived_expenses SET expense_id = id")
+                    connection.connection.execute("""CREATE UNIQUE INDEX archived_expenses_expense_id
+                                                     ON archived_expenses (expense_id)""")
+            connection.connection.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)",
+                                              [(name,) for name in categories])
+            connection.commit()
+        except sqlite3.Error as e:
+            raise sqlite_error(e) from e
+        finally:
+            connection.close()
 
 class ExpenseTracker:
+    INSERT_EXPENSE_QUERY = """INSERT INTO expenses 
+                              (amount, category_id, description, date, dedup_key, user_id) 
+                              VALUES (%s, %s, %s, %s, %s, %s)"""
+    TOTAL_QUERY = "SELECT SUM(amount), COUNT(*) FROM expenses"
+    CATEGORY_TOTALS_QUERY = "SELECT category_id, SUM(amount) FROM expenses GROUP BY category_id"
+    # archived_expenses numbers its own rows; the expense id goes in expense_id, whose
+    # unique index stops a row from being archived twice
+    ARCHIVE_COLUMNS = "expense_id, amount, category_id, description, date, user_id"
+    ARCHIVE_SOURCE_COLUMNS = "e.id, e.amount, e.category_id, e.description, e.date, e.user_id"
+    ARCHIVE_SELECT_QUERY = "SELECT id FROM expenses WHERE date < %s AND id > %s ORDER BY id LIMIT %s"
+    # Batches are id ranges rather than IN lists so the statement text never changes
+    ARCHIVE_COPY_QUERY = f"""INSERT INTO archived_expenses ({ARCHIVE_COLUMNS})
+                             SELECT {ARCHIVE_SOURCE_COLUMNS} FROM expenses e
+                             WHERE e.id BETWEEN %s AND %s AND e.date < %s
+                             AND NOT EXISTS (SELECT 1 FROM archived_expenses a WHERE a.expense_id = e.id)"""
+    ARCHIVE_DELETE_QUERY = "DELETE FROM expenses WHERE id BETWEEN %s AND %s AND date < %s"
+    # Bump when the snapshot layout changes so old snapshots are ignored
+    SNAPSHOT_VERSION = 2
+
     def __init__(self):
         """Initialize the expense tracker with database connection and file handling setup"""
         self.expenses_file = 'expenses.json'
         self.summary_file = 'expense_summary.json'
         self.valid_categories = {'food', 'transport', 'entertainment', 'utilities', 'other'}
-        self.db_connection = self.connect_to_database()
-        self.load_expenses()
+        # Seconds between reconciling the in-memory totals against MySQL (0 = startup only)
+        self.reconcile_interval = float(os.getenv('SUMMARY_RECONCILE_INTERVAL', '300'))
+        # 'incremental' running totals, 'sql' aggregate queries every time, or a
+        # 'memory' pass over the loaded expenses (covers only what EXPENSE_MEMORY_LIMIT keeps)
+        self.summary_mode = os.getenv('SUMMARY_ENGINE', 'incremental')
+        # 'pretty' keeps the indented file; 'compact' drops whitespace and caps the expense list
+        self.summary_format = os.getenv('SUMMARY_FORMAT', 'pretty')
+        default_recent_limit = '100' if self.summary_format == 'compact' else '0'
+        self.summary_recent_limit = int(os.getenv('SUMMARY_RECENT_LIMIT', default_recent_limit))
+        # Also write expense_summary.json.gz for web servers that serve pre-compressed files
+        self.summary_gzip = os.getenv('SUMMARY_GZIP', '0') == '1'
+        # Rewrite the summary at most once per SUMMARY_INTERVAL seconds (0 = after every change)
+        summary_interval = float(os.getenv('SUMMARY_INTERVAL', '1'))
+        self.summary_scheduler = SummaryScheduler(self, summary_interval) if summary_interval > 0 else None
+        self.summary_engine = SummaryEngine(self.valid_categories,
+                                            change_log_size=int(os.getenv('SUMMARY_CHANGE_LOG_SIZE', '1000')))
+        # Ingestion workers share one summary file
+        self.summary_lock = threading.Lock()
+        # Held while adding to the in-memory expenses, so removing archived ones loses no new expense
+        self.expense_lock = threading.Lock()
+        # Encoded summary served over HTTP, rebuilt only after the totals change
+        self.summary_cache = None
+        # Summary changes pushed to HTTP clients as server-sent events
+        self.event_bus = SummaryEventBus(int(os.getenv('EVENT_QUEUE_SIZE', '1000')))
+        self.summary_engine.listeners.append(self.publish_change)
+        # 'mysql', or 'sqlite' for an embedded database file (SQLITE_PATH) that needs no server
+        self.storage_backend = os.getenv('STORAGE_BACKEND', 'mysql')
+        # How hard to try for a healthy pooled connection before giving up
+        self.db_checkout_attempts = int(os.getenv('DB_CHECKOUT_ATTEMPTS', '3'))
+        self.db_retry_delay = float(os.getenv('DB_RETRY_DELAY', '0.5'))
+        self.db_pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+        # Hot statements run through server-side prepared cursors kept per pooled connection
+        self.prepared_statements = os.getenv('DB_PREPARED_STATEMENTS', '1') == '1'
+        self.prepared_cursors = weakref.WeakKeyDictionary()
+        self.prepared_lock = threading.Lock()
+        # Expenses are loaded in pages; optionally keep only the newest N or the last N days in memory
+        self.page_size = int(os.getenv('EXPENSE_PAGE_SIZE', '1000'))
+        self.memory_limit = int(os.getenv('EXPENSE_MEMORY_LIMIT', '0'))
+        self.memory_window_days = int(os.getenv('EXPENSE_WINDOW_DAYS', '0'))
+        # 'dict' keeps the rows as returned by MySQL, 'compact' uses CompactExpenseStore
+        self.expense_store = os.getenv('EXPENSE_STORE', 'dict')
+        # Archive in batches of ARCHIVE_BATCH_SIZE rows, pausing between batches to let other queries in
+        self.archive_batch_size = int(os.getenv('ARCHIVE_BATCH_SIZE', '1000'))
+        self.archive_batch_pause = float(os.getenv('ARCHIVE_BATCH_PAUSE', '0.05'))
+        # Background archival schedule (ARCHIVE_INTERVAL_HOURS=0 archives once at startup only)
+        self.archive_interval = float(os.getenv('ARCHIVE_INTERVAL_HOURS', '24')) * 3600
+        self.archive_retention_days = int(os.getenv('ARCHIVE_RETENTION_DAYS', '365'))
+        # Monthly RANGE partitions on expenses.date let whole months be archived by dropping a partition
+        self.partitioning = os.getenv('EXPENSE_PARTITIONING', '0') == '1'
+        if self.partitioning and self.storage_backend != 'mysql':
+            print("EXPENSE_PARTITIONING is only supported with MySQL, archiving row by row")
+            self.partitioning = False
+        self.partition_months_ahead = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+        self.reconnect_lock = threading.Lock()
+        self.db_pool = self.connect_to_database()
+        # Brings tables from older versions up to date, so it runs before anything is read
+        self.ensure_expense_columns()
+        # Category names are resolved in memory instead of with a subquery per INSERT
+        self.category_cache = CategoryCache(self, ttl=float(os.getenv('CATEGORY_CACHE_TTL', '300')),
+                                            miss_refresh_interval=float(os.getenv('CATEGORY_MISS_REFRESH', '5')))
+        self.load_categories()
+        # Repeated expenses are caught by this LRU first and by a unique index on dedup_key after that
+        self.dedup_cache = DedupCache(int(os.getenv('DEDUP_CACHE_SIZE', '100000')))
+        # Restarts restore the state saved at the last shutdown and read only the rows added since.
+        # It lives outside the watched folder, which browser downloads also land in
+        state_dir = os.getenv('EXPENSE_STATE_DIR', os.path.join(os.path.expanduser('~'), '.expense_tracker'))
+        self.snapshot_file = os.getenv('EXPENSE_SNAPSHOT_FILE', os.path.join(state_dir, 'expense_tracker.snapshot'))
+        self.snapshot_max_age = float(os.getenv('SNAPSHOT_MAX_AGE_HOURS', '24')) * 3600
+        if os.getenv('EXPENSE_SNAPSHOT', '1') != '1':
+            self.snapshot_file = None
+        high_water_id = self.load_snapshot()
+        if high_water_id is None:
+            self.load_expenses()
+            self.reconcile_summary()
+        else:
+            self.load_new_expenses(high_water_id)
+        # Expenses that arrive while MySQL is down go to a local fsync'd spool instead of being dropped
+        self.spool = None
+        if os.getenv('EXPENSE_SPOOL', '1') == '1':
+            self.spool = ExpenseSpool(self, os.getenv('EXPENSE_SPOOL_FILE', 'expense_spool.log'),
+                                      interval=float(os.getenv('SPOOL_FLUSH_INTERVAL', '5')),
+                                      batch_size=int(os.getenv('SPOOL_BATCH_SIZE', '500')))
+        self.reconnector = None
+        if not self.db_pool:
+            self.reconnector = DatabaseReconnector(self, float(os.getenv('DB_RECONNECT_INTERVAL', '5')))
 
     def connect_to_database(self):
-        """Establish connection to MySQL database"""
+        """Create a pool of connections to the STORAGE_BACKEND database using environment variables"""
+        if self.storage_backend == 'sqlite':
+            return self.open_sqlite_database()
+        if self.storage_backend != 'mysql':
+            print(f"Unknown STORAGE_BACKEND {self.storage_backend!r}, expected mysql or sqlite")
+            return None
         try:
-            connection = mysql.connector.connect(
-                host='localhost',
-                database='expense_tracker',
-                user='your_username',
-                password='your_password'
+            connection_pool = pooling.MySQLConnectionPool(
+                pool_name=os.getenv('DB_POOL_NAME', 'expense_tracker_pool'),
+                pool_size=int(os.getenv('DB_POOL_SIZE', '5')),
+                # Resetting the session on checkout would discard the prepared statements
+                pool_reset_session=not self.prepared_statements,
+                host=os.getenv('DB_HOST', 'localhost'),
+                database=os.getenv('DB_NAME', 'expense_tracker'),
+                user=os.getenv('DB_USER'),
+                password=os.getenv('DB_PASSWORD')
             )
-            if connection.is_connected():
-                print("Successfully connected to MySQL database")
-                return connection
+            print("Successfully connected to MySQL database")
+            return connection_pool
         except Error as e:
             print(f"Error connecting to MySQL database: {e}")
             return None
 
-    def load_expenses(self):
-        """Load existing expenses from database"""
-        if self.db_connection:
+    def open_sqlite_database(self):
+        """Open the embedded SQLite database file, creating its tables on first use"""
+        path = os.getenv('SQLITE_PATH', 'expense_tracker.db')
+        try:
+            connection_pool = SQLiteConnectionPool(
+                path,
+                pool_size=int(os.getenv('DB_POOL_SIZE', '5')),
+                busy_timeout=float(os.getenv('SQLITE_BUSY_TIMEOUT', '5')),
+                synchronous=os.getenv('SQLITE_SYNCHRONOUS', 'FULL')
+            )
+            connection_pool.create_schema(sorted(self.valid_categories))
+            print(f"Successfully opened SQLite database {path}")
+            return connection_pool
+        except Error as e:
+            print(f"Error opening SQLite database {path}: {e}")
+            return None
+
+    def reconnect_database(self):
+        """Create the pool again after MySQL was unreachable at startup, reloading state once it is up
+        
+        Called by both the reconnector and a spool replay, so only one of them builds the pool.
+        """
+        with self.reconnect_lock:
+            if self.db_pool:
+                return True
+            db_pool = self.connect_to_database()
+            if not db_pool:
+                return False
+            self.db_pool = db_pool
+            self.ensure_expense_columns()
+            self.load_categories()
+            self.load_expenses()
+            self.reconcile_summary()
+        print("Reconnected to the database")
+        self.request_summary_update()
+        return True
+
+    def checkout_connection(self):
+        """Take a connection from the pool, reconnecting it if the server dropped it
+        
+        When every connection is in use this waits up to DB_POOL_TIMEOUT seconds for one to
+        be handed back; a busy pool is not a reason to treat the database as unavailable.
+        """
+        last_error = None
+        wait_until = time.monotonic() + self.db_pool_timeout
+        for attempt in range(self.db_checkout_attempts):
+            if attempt:
+                time.sleep(self.db_retry_delay)
+            while True:
+                try:
+                    connection = self.db_pool.get_connection()
+                    break
+                except PoolError:
+                    if time.monotonic() >= wait_until:
+                        raise
+                    time.sleep(0.005)
             try:
-                cursor = self.db_connection.cursor(dictionary=True)
-                cursor.execute("SELECT * FROM expenses ORDER BY date DESC")
-                self.expense_list = cursor.fetchall()
-                cursor.close()
+                # Health check; re-open the socket if the server dropped it (e.g. wait_timeout)
+                try:
+                    connection.ping()
+                except Error:
+                    connection.ping(reconnect=True, attempts=2, delay=self.db_retry_delay)
+                    # A new session has none of the old prepared statements
+                    self.forget_prepared_statements(connection)
+                return connection
+            except Error as e:
+                last_error = e
+                connection.close()
+        raise last_error
+
+    @contextmanager
+    def database_connection(self):
+        """Borrow a healthy pooled connection for the duration of a with block"""
+        connection = self.checkout_connection()
+        try:
+            yield connection
+        finally:
+            # The pool no longer resets sessions (that would drop the prepared statements), so
+            # end any transaction a read left open; the next borrower would otherwise see its
+            # stale REPEATABLE READ snapshot and be unable to start a transaction of its own
+            try:
+                if connection.in_transaction:
+                    connection.rollback()
             except Error as e:
-                print(f"Error loading expenses: {e}")
-                self.expense_list = []
+                print(f"Error ending the transaction of a pooled connection: {e}")
+            # Closing a pooled connection hands it back to the pool
+            connection.close()
+
+    @contextmanager
+    def statement_cursor(self, connection, query):
+        """Yield a cursor for one hot statement, reusing its prepared cursor on this connection"""
+        if not self.prepared_statements:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+            return
+
+        # The pool hands out a wrapper per checkout; prepared statements belong to the real connection
+        raw_connection = getattr(connection, '_cnx', connection)
+        with self.prepared_lock:
+            cursors = self.prepared_cursors.setdefault(raw_connection, {})
+        cursor = cursors.get(query)
+        if cursor is None:
+            cursor = connection.cursor(prepared=True)
+            cursors[query] = cursor
+        try:
+            yield cursor
+        except Error:
+            # Prepare it again next time in case the statement handle is no longer valid
+            cursors.pop(query, None)
+            raise
+
+    def forget_prepared_statements(self, connection):
+        """Drop the cached prepared cursors of a connection that has reconnected"""
+        with self.prepared_lock:
+            self.prepared_cursors.pop(getattr(connection, '_cnx', connection), None)
+
+    def load_categories(self):
+        """Read the categories table and use it as the list of valid categories"""
+        if self.category_cache.refresh():
+            self.use_loaded_categories()
+
+    def use_loaded_categories(self):
+        """Validate against the categories held in the category cache"""
+        self.valid_categories = set(self.category_cache.ids_by_name)
+        self.summary_engine.categories = set(self.valid_categories)
+
+    def ensure_expense_columns(self):
+        """Add the columns the tracker stores beyond the original schema when they are missing
+        
+        That is category_id in place of the category name column, dedup_key with its unique
+        index, user_id on expenses and archived_expenses, and expense_id on archived_expenses.
+        """
+        # The SQLite schema is created with them
+        if not self.db_pool or self.storage_backend != 'mysql':
+            return
+        try:
+            with self.database_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS
+                                  WHERE TABLE_SCHEMA = DATABASE()
+                                  AND TABLE_NAME IN ('expenses', 'archived_expenses')""")
+                columns = {(table_name, column_name): column_type
+                           for table_name, column_name, column_type in cursor.fetchall()}
+                table_names = [table_name for table_name in ('expenses', 'archived_expenses')
+                               if any(table == table_name for table, _ in columns)]
+                for table_name in table_names:
+                    if (table_name, 'category_id') not in columns:
+                        self.migrate_category_column(connection, cursor, table_name,
+                                                     columns.get((table_name, 'category')))
+                if 'expenses' in table_names and ('expenses', 'dedup_key') not in columns:
+                    print("Adding dedup_key column and unique index to expenses")
+                    # ensure_partitions adds date to the key before partitioning, as MySQL requires
+                    cursor.execute("""ALTER TABLE expenses ADD COLUMN dedup_key CHAR(64) NULL,
+                                      ADD UNIQUE INDEX expenses_dedup_key (dedup_key)""")
+                elif 'expenses' in table_names and not self.partitioning:
+                    self.narrow_dedup_index(cursor)
+                for table_name in table_names:
+                    if (table_name, 'user_id') not in columns:
+                        print(f"Adding user_id column to {table_name}")
+                        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN user_id INT NULL")
+                if 'archived_expenses' in table_names and ('archived_expenses', 'expense_id') not in columns:
+                    # Rows archived before this have no expense_id; NULLs do not clash in the unique index
+                    print("Adding expense_id column and unique index to archived_expenses")
+                    cursor.execute("""ALTER TABLE archived_expenses ADD COLUMN expense_id INT NULL,
+                                      ADD UNIQUE INDEX archived_expenses_expense_id (expense_id)""")
+                cursor.close()
+        except Error as e:
+            print(f"Error checking the expense columns: {e}")
+
+    def narrow_dedup_index(self, cursor):
+        """Make dedup_key unique on its own on a table that is not partitioned
+        
+        Earlier versions keyed it on (dedup_key, date), which let a client_id resent with another date through.
+        """
+        cursor.execute("""SELECT COUNT(*) FROM information_schema.STATISTICS
+                          WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'expenses'
+                          AND INDEX_NAME = 'expenses_dedup_key'""")
+        if cursor.fetchone()[0] < 2 or self.expense_partition_names(cursor):
+            return
+        print("Making dedup_key unique on its own")
+        try:
+            cursor.execute("""ALTER TABLE expenses DROP INDEX expenses_dedup_key,
+                              ADD UNIQUE INDEX expenses_dedup_key (dedup_key)""")
+        except Error as e:
+            print(f"Error narrowing the dedup_key index, keeping (dedup_key, date): {e}")
+
+    def migrate_category_column(self, connection, cursor, table_name, category_type):
+        """Give a table that stores category names a category_id column referencing categories
+        
+        The name column is kept (made nullable, since new rows only carry the id) so nothing is lost.
+        """
+        if category_type is None:
+            raise RuntimeError(f"{table_name} has neither a category_id nor a category column; "
+                               "check DB_NAME points at the expense tracker database")
+        print(f"Moving {table_name} from category names to category ids")
+        try:
+            cursor.execute("""CREATE TABLE IF NOT EXISTS categories (
+                                  category_id INT AUTO_INCREMENT PRIMARY KEY,
+                                  name VARCHAR(50) NOT NULL UNIQUE)""")
+            cursor.executemany("INSERT IGNORE INTO categories (name) VALUES (%s)",
+                               [(category,) for category in sorted(self.valid_categories)])
+            # Names stored by earlier versions keep working even if they are not in the default list
+            cursor.execute(f"""INSERT IGNORE INTO categories (name)
+                               SELECT DISTINCT category FROM {table_name} WHERE category IS NOT NULL""")
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN category_id INT NULL")
+            cursor.execute(f"""UPDATE {table_name} JOIN categories ON categories.name = {table_name}.category
+                               SET {table_name}.category_id = categories.category_id""")
+            cursor.execute(f"ALTER TABLE {table_name} MODIFY category {category_type} NULL")
+            connection.commit()
+        except Error as e:
+            raise RuntimeError(f"{table_name} still stores category names and could not be moved to "
+                               f"category ids: {e}") from e
+
+    def load_expenses(self):
+        """Load existing expenses from database, newest first, one page at a time"""
+        self.expense_list = self.new_expense_store()
+        if not self.db_pool:
+            return
+
+        window_start = self.expense_window_start()
+        try:
+            with self.database_connection() as connection:
+                cursor = connection.cursor(dictionary=True)
+                last_row = None
+                while True:
+                    page_size = self.next_page_size()
+                    if page_size <= 0:
+                        break
+                    cursor.execute(*self.expense_page_query(window_start, last_row, page_size))
+                    page = cursor.fetchall()
+                    self.add_loaded_page(page)
+                    if len(page) < page_size:
+                        break
+                    last_row = page[-1]
+                cursor.close()
+        except Error as e:
+            print(f"Error loading expenses: {e}")
+            self.expense_list = self.new_expense_store()
+
+    def expense_window_start(self):
+        """Return the oldest date kept in memory, or None when EXPENSE_WINDOW_DAYS is not set"""
+        if self.memory_window_days:
+            return datetime.now() - timedelta(days=self.memory_window_days)
+        return None
+
+    def next_page_size(self):
+        """Rows to ask for in the next page, stopping at EXPENSE_MEMORY_LIMIT"""
+        if self.memory_limit:
+            return min(self.page_size, self.memory_limit - len(self.expense_list))
+        return self.page_size
+
+    def expense_page_query(self, window_start, last_row, page_size):
+        """Build the query and parameters for the page of expenses after last_row, newest first"""
+        conditions = []
+        params = []
+        if window_start:
+            conditions.append("date >= %s")
+            params.append(window_start)
+        if last_row:
+            # Keyset pagination: continue after the last row of the previous page
+            conditions.append("(date < %s OR (date = %s AND id < %s))")
+            params.extend([last_row['date'], last_row['date'], last_row['id']])
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return (f"SELECT * FROM expenses {where_clause} ORDER BY date DESC, id DESC LIMIT %s",
+                (*params, page_size))
+
+    def add_loaded_page(self, page):
+        """Name the categories of a loaded page, remember its dedup keys and store it"""
+        for row in page:
+            row['category'] = self.category_cache.category_name(row['category_id'])
+            if row.get('dedup_key'):
+                self.dedup_cache.add(row['dedup_key'])
+        self.expense_list.extend(self.stored_expense(row) for row in page)
+
+    @staticmethod
+    def stored_expense(expense_data):
+        """Keep only the EXPENSE_FIELDS of a saved expense or loaded row, so both look the same"""
+        expense = {field: expense_data[field] for field in EXPENSE_FIELDS if expense_data.get(field) is not None}
+        # MySQL returns DECIMAL amounts, validated expenses carry floats
+        expense['amount'] = float(expense['amount'])
+        return expense
+
+    def load_new_expenses(self, after_id):
+        """Apply the rows added since the snapshot's high-water mark, oldest first"""
+        loaded = 0
+        try:
+            with self.database_connection() as connection:
+                cursor = connection.cursor(dictionary=True)
+                while True:
+                    cursor.execute("SELECT * FROM expenses WHERE id > %s ORDER BY id LIMIT %s",
+                                   (after_id, self.page_size))
+                    page = cursor.fetchall()
+                    for row in page:
+                        row['category'] = self.category_cache.category_name(row['category_id'])
+                        self.apply_saved_expense(row)
+                    loaded += len(page)
+                    if len(page) < self.page_size:
+                        break
+                    after_id = page[-1]['id']
+                cursor.close()
+        except Error as e:
+            # The snapshot alone is out of date, so start from the database instead
+            print(f"Error loading new expenses, reloading everything: {e}")
+            self.load_expenses()
+            self.reconcile_summary()
+            return
+        self.trim_expense_window()
+        print(f"Restored {len(self.expense_list)} expenses from {self.snapshot_file} ({loaded} newer rows loaded)")
+
+    def trim_expense_window(self):
+        """Drop restored expenses that have aged out of EXPENSE_WINDOW_DAYS"""
+        if not self.memory_window_days:
+            return
+        window_start = CompactExpenseStore.date_to_timestamp(
+            datetime.now() - timedelta(days=self.memory_window_days))
+        if isinstance(self.expense_list, CompactExpenseStore):
+            self.expense_list.trim_older_than(window_start)
+            return
+        while (self.expense_list and
+               CompactExpenseStore.date_to_timestamp(self.expense_list[-1]['date']) < window_start):
+            self.expense_list.pop()
+
+    def expense_high_water_mark(self):
+        """Return the highest expense id in the database, or None if it cannot be read"""
+        if not self.db_pool:
+            return None
+        try:
+            with self.database_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT MAX(id) FROM expenses")
+                high_water_id = cursor.fetchall()[0][0]
+                cursor.close()
+            return high_water_id or 0
+        except Error as e:
+            print(f"Error reading the expense high-water mark: {e}")
+            return None
+
+    def snapshot_settings(self):
+        """Settings a snapshot must have been taken with to be reused"""
+        if self.storage_backend == 'sqlite':
+            database = os.path.abspath(os.getenv('SQLITE_PATH', 'expense_tracker.db'))
         else:
-            self.expense_list = []
+            database = f"{os.getenv('DB_HOST', 'localhost')}/{os.getenv('DB_NAME', 'expense_tracker')}"
+        return {'expense_store': self.expense_store, 'memory_limit': self.memory_limit,
+                'storage_backend': self.storage_backend, 'database': database}
+
+    def read_snapshot(self):
+        """Read the snapshot's JSON header line and the column bytes that follow it
+        
+        The file holds only data, so a planted or corrupt snapshot can at worst be rejected.
+        """
+        with open(self.snapshot_file, 'rb') as snapshot:
+            state = json.loads(snapshot.readline())
+            payload = snapshot.read()
+        if not isinstance(state, dict) or len(payload) != state.get('payload_size'):
+            raise ValueError("not a complete expense tracker snapshot")
+        return state, payload
+
+    def load_snapshot(self):
+        """Restore expenses and totals from the snapshot, returning its high-water mark id
+        
+        Returns None when there is no usable snapshot and everything must be loaded from MySQL.
+        """
+        if not self.snapshot_file or not self.db_pool or not os.path.exists(self.snapshot_file):
+            return None
+        try:
+            state, payload = self.read_snapshot()
+        except (OSError, ValueError) as e:
+            print(f"Error reading snapshot {self.snapshot_file}: {e}")
+            return None
+
+        if state.get('version') != self.SNAPSHOT_VERSION or state.get('settings') != self.snapshot_settings():
+            print(f"Ignoring snapshot {self.snapshot_file}: taken with different settings")
+            return None
+        try:
+            # Everything is checked before any of it replaces the tracker's state
+            saved_at = float(state['saved_at'])
+            snapshot_high_water_id = int(state['high_water_id'])
+            summary = state['summary']
+            totals = (float(summary['total_amount']),
+                      {str(category): float(total) for category, total in summary['category_totals'].items()},
+                      int(summary['expense_count']))
+            dedup_keys = [str(dedup_key) for dedup_key in state['dedup_keys']]
+            expense_list = self.restore_expense_store(state['expenses'], payload)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            print(f"Ignoring snapshot {self.snapshot_file}: {e}")
+            return None
+        if time.time() - saved_at > self.snapshot_max_age:
+            print(f"Ignoring snapshot {self.snapshot_file}: older than SNAPSHOT_MAX_AGE_HOURS")
+            return None
+        high_water_id = self.expense_high_water_mark()
+        if high_water_id is None or high_water_id < snapshot_high_water_id:
+            # Rows the snapshot counts are gone, e.g. the table was recreated
+            print(f"Ignoring snapshot {self.snapshot_file}: it does not match the database")
+            return None
+
+        self.expense_list = expense_list
+        self.summary_engine.reset(*totals)
+        for dedup_key in dedup_keys:
+            self.dedup_cache.add(dedup_key)
+        return snapshot_high_water_id
+
+    def restore_expense_store(self, data, payload):
+        """Rebuild the in-memory expenses from the data written by save_snapshot"""
+        expense_list = self.new_expense_store()
+        if isinstance(expense_list, CompactExpenseStore):
+            expense_list.restore_columns(data, payload)
+            return expense_list
+        for expense_data in data['rows']:
+            expense = {field: expense_data[field] for field in EXPENSE_FIELDS if field in expense_data}
+            expense['amount'] = float(expense['amount'])
+            expense['date'] = datetime.fromisoformat(expense['date'])
+            if not isinstance(expense['category'], str):
+                raise ValueError("category names must be strings")
+            expense_list.append(expense)
+        return expense_list
+
+    def save_snapshot(self):
+        """Write the in-memory expenses, totals and high-water mark for a fast next start
+        
+        The file is a JSON header line followed by the raw bytes of the compact store's
+        typed columns, so it can be read back without running anything from it.
+        """
+        if not self.snapshot_file:
+            return
+        high_water_id = self.expense_high_water_mark()
+        if high_water_id is None:
+            # Without a high-water mark the next start could miss rows, so it must load everything
+            if os.path.exists(self.snapshot_file):
+                os.remove(self.snapshot_file)
+            return
+
+        if isinstance(self.expense_list, CompactExpenseStore):
+            expenses, payload = self.expense_list.snapshot_columns()
+        else:
+            expenses = {'rows': [dict(expense, date=expense['date'].isoformat())
+                                 if isinstance(expense.get('date'), datetime) else expense
+                                 for expense in self.expense_list]}
+            payload = b''
+        state = {
+            'version': self.SNAPSHOT_VERSION,
+            'settings': self.snapshot_settings(),
+            'saved_at': time.time(),
+            'high_water_id': high_water_id,
+            'summary': self.summary_engine.snapshot(),
+            'expenses': expenses,
+            'payload_size': len(payload),
+            'dedup_keys': list(self.dedup_cache.keys)
+        }
+        temporary_file = f"{self.snapshot_file}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_file)), exist_ok=True)
+            with open(temporary_file, 'wb') as snapshot:
+                snapshot.write(json.dumps(state, default=json_default).encode('utf-8') + b'\n')
+                snapshot.write(payload)
+            os.replace(temporary_file, self.snapshot_file)
+            print(f"Saved snapshot of {len(self.expense_list)} expenses to {self.snapshot_file}")
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error writing snapshot {self.snapshot_file}: {e}")
+
+    def new_expense_store(self):
+        """Create an empty in-memory expense collection of the configured kind"""
+        if self.expense_store == 'compact':
+            return CompactExpenseStore(maxlen=self.memory_limit or None)
+        # New expenses are added on the left, so a full deque drops the oldest one
+        return deque(maxlen=self.memory_limit or None)
 
     def save_expense(self, expense_data):
         """Save expense to MySQL database"""
-        if self.db_connection:
-            try:
-                cursor = self.db_connection.cursor()
-                query = """INSERT INTO expenses 
-                          (amount, category, description, date) 
-                          VALUES (%s, %s, %s, %s)"""
-                values = (
-                    expense_data['amount'],
-                    expense_data['category'],
-                    expense_data['description'],
-                    expense_data['date']
-                )
-                cursor.execute(query, values)
-                self.db_connection.commit()
+        return self.save_expenses([expense_data])[0] is None
+
+    def save_expenses(self, expense_batch):
+        """Save a batch of expenses with one multi-row INSERT in a single transaction
+        
+        Returns a list holding an error message, or None on success, for each expense.
+        The message is DATABASE_UNAVAILABLE for expenses that never reached the server.
+        Each saved expense dict is given the id of its new row.
+        """
+        if not expense_batch:
+            return []
+        if not self.db_pool:
+            return [DATABASE_UNAVAILABLE] * len(expense_batch)
+
+        rows = self.expense_rows(expense_batch)
+        try:
+            with self.database_connection() as connection:
+                if len(rows) > 1:
+                    cursor = connection.cursor()
+                    try:
+                        # executemany rewrites this into a single multi-row INSERT
+                        connection.start_transaction()
+                        cursor.executemany(self.INSERT_EXPENSE_QUERY, rows)
+                        # lastrowid is the id of the first row only
+                        self.read_batch_ids(cursor, expense_batch, cursor.lastrowid)
+                        connection.commit()
+                        cursor.close()
+                        return [None] * len(rows)
+                    except Error as e:
+                        connection.rollback()
+                        print(f"Error saving expense batch, retrying row by row: {e}")
+
+                    cursor.close()
+
+                # Insert the rows one at a time (through the prepared INSERT) so each
+                # failure is reported against its own row
+                errors = []
+                for expense_data, row in zip(expense_batch, rows):
+                    try:
+                        with self.statement_cursor(connection, self.INSERT_EXPENSE_QUERY) as row_cursor:
+                            row_cursor.execute(self.INSERT_EXPENSE_QUERY, row)
+                            expense_data['id'] = row_cursor.lastrowid
+                        connection.commit()
+                        errors.append(None)
+                    except Error as e:
+                        connection.rollback()
+                        if e.errno == errorcode.ER_DUP_ENTRY:
+                            errors.append(VALIDATION_ERRORS['duplicate'])
+                        elif is_connection_error(e):
+                            errors.append(DATABASE_UNAVAILABLE)
+                        else:
+                            errors.append(str(e))
+                return errors
+        except Error as e:
+            print(f"Error saving expenses: {e}")
+            if is_connection_error(e):
+                return [DATABASE_UNAVAILABLE] * len(rows)
+            return [str(e)] * len(rows)
+
+    def read_batch_ids(self, cursor, expense_batch, first_id):
+        """Find the ids of a multi-row INSERT inside its transaction and give them to the expenses"""
+        query = batch_ids_query(expense_batch, first_id)
+        if query:
+            cursor.execute(*query)
+            assign_batch_ids(expense_batch, first_id, id_rows=cursor.fetchall())
+            return
+        id_step = 1
+        if self.storage_backend == 'mysql':
+            cursor.execute("SELECT @@auto_increment_increment")
+            id_step, = cursor.fetchone()
+        assign_batch_ids(expense_batch, first_id, id_step=id_step)
+
+    def store_expenses(self, records):
+        """Save validated expenses, spooling them instead while the database is unavailable
+        
+        Returns None for each saved expense, SPOOLED for each spooled one, or an error message
+        """
+        if self.spool is None:
+            return self.save_expenses(records)
+        if self.spool.has_backlog():
+            # Nothing skips ahead of the spool, and nobody waits on a database that is known to be down
+            errors = [DATABASE_UNAVAILABLE] * len(records)
+        else:
+            errors = self.save_expenses(records)
+        return self.spool_unsaved(records, errors)
+
+    def spool_unsaved(self, records, errors):
+        """Spool the records save_expenses could not get to the database, returning the updated errors"""
+        if self.spool is None:
+            return errors
+        unsaved = [record for record, error_message in zip(records, errors) if error_message == DATABASE_UNAVAILABLE]
+        if not unsaved:
+            return errors
+        for record in unsaved:
+            if record['dedup_key'] is None:
+                # Lets the unique index reject what an interrupted replay already saved
+                record['dedup_key'] = uuid.uuid4().hex
+        if not self.spool.append(unsaved):
+            return errors
+        for record in unsaved:
+            # A file picked up twice before the spool drains is still caught as a duplicate
+            self.dedup_cache.add(record['dedup_key'])
+        return [SPOOLED if error_message == DATABASE_UNAVAILABLE else error_message for error_message in errors]
+
+    def expense_rows(self, expense_batch):
+        """Build the INSERT parameters for a batch of expenses"""
+        return [self.expense_values(expense_data) for expense_data in expense_batch]
+
+    def expense_values(self, expense_data):
+        """Build the INSERT parameters for one expense"""
+        category_id = expense_data.get('category_id')
+        if category_id is None:
+            category_id = self.category_cache.category_id(expense_data['category'])
+        return (
+            expense_data['amount'],
+            category_id,
+            expense_data['description'],
+            expense_data['date'],
+            expense_data.get('dedup_key'),
+            expense_data.get('user_id')
+        )
+
+    def archive_old_expenses(self, archive_date, stop_event=None):
+        """Move expenses older than archive_date to archived_expenses in primary key order
+        
+        Each batch is copied and deleted in one transaction, so an interrupted run never
+        duplicates rows and can simply be started again to carry on where it stopped.
+        Setting stop_event ends the run after the current batch.
+        """
+        if not self.db_pool:
+            return 0
+
+        # Whole months go by partition; only the rows of the boundary month are moved in batches
+        archived_total = self.archive_partitions(archive_date) if self.partitioning else 0
+        last_id = 0
+        try:
+            with self.database_connection() as connection:
+                while True:
+                    connection.start_transaction()
+                    with self.statement_cursor(connection, self.ARCHIVE_SELECT_QUERY) as cursor:
+                        cursor.execute(self.ARCHIVE_SELECT_QUERY, (archive_date, last_id, self.archive_batch_size))
+                        batch_ids = [row[0] for row in cursor.fetchall()]
+                    if not batch_ids:
+                        connection.commit()
+                        break
+
+                    # Newer ids in the range are skipped by the date condition
+                    batch_range = (batch_ids[0], batch_ids[-1], archive_date)
+                    with self.statement_cursor(connection, self.ARCHIVE_COPY_QUERY) as cursor:
+                        cursor.execute(self.ARCHIVE_COPY_QUERY, batch_range)
+                    with self.statement_cursor(connection, self.ARCHIVE_DELETE_QUERY) as cursor:
+                        cursor.execute(self.ARCHIVE_DELETE_QUERY, batch_range)
+                    connection.commit()
+
+                    archived_total += len(batch_ids)
+                    last_id = batch_ids[-1]
+                    print(f"Archived {archived_total} expenses older than {archive_date} (up to id {last_id})")
+                    if len(batch_ids) < self.archive_batch_size:
+                        break
+                    if stop_event and stop_event.is_set():
+                        print("Archiving paused for shutdown")
+                        break
+                    time.sleep(self.archive_batch_pause)
+        except Error as e:
+            print(f"Error archiving expenses: {e}")
+
+        # The running totals still include the archived rows until they are reconciled
+        if archived_total:
+            self.forget_archived_expenses(archive_date)
+            self.summary_engine.record_archived(archive_date, archived_total)
+            self.reconcile_summary()
+        return archived_total
+
+    def forget_archived_expenses(self, archive_date):
+        """Remove expenses dated before archive_date from memory once they have been archived"""
+        cutoff = CompactExpenseStore.date_to_timestamp(archive_date)
+        if isinstance(self.expense_list, CompactExpenseStore):
+            self.expense_list.remove_older_than(cutoff)
+            return
+        with self.expense_lock:
+            kept = [expense_data for expense_data in self.expense_list
+                    if CompactExpenseStore.date_to_timestamp(expense_data['date']) >= cutoff]
+            if len(kept) < len(self.expense_list):
+                # A new deque, so summaries being written from the old one are not disturbed
+                self.expense_list = deque(kept, maxlen=self.expense_list.maxlen)
+
+    def expense_partition_names(self, cursor):
+        """List the partitions of the expenses table in range order (empty if not partitioned)"""
+        cursor.execute("""SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+                          WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'expenses'
+                          AND PARTITION_NAME IS NOT NULL
+                          ORDER BY PARTITION_ORDINAL_POSITION""")
+        return [row[0] for row in cursor.fetchall()]
+
+    def ensure_partitions(self):
+        """Partition expenses by month on first use and keep partitions ready for coming months"""
+        if not self.db_pool:
+            return
+        last_month = add_months(month_start(datetime.now()), self.partition_months_ahead)
+        try:
+            with self.database_connection() as connection:
+                cursor = connection.cursor()
+                month_partitions = [name for name in self.expense_partition_names(cursor) if name != 'pmax']
+                if month_partitions:
+                    first_month = add_months(partition_month(month_partitions[-1]), 1)
+                    definitions = partition_definitions(first_month, last_month)
+                    if definitions:
+                        # Split the catch-all partition, which is normally empty because partitions exist ahead of now
+                        cursor.execute(f"""ALTER TABLE expenses REORGANIZE PARTITION pmax INTO
+                                           ({', '.join(definitions)}, PARTITION pmax VALUES LESS THAN (MAXVALUE))""")
+                        print(f"Added {len(definitions)} monthly expense partitions")
+                else:
+                    cursor.execute("SELECT MIN(date) FROM expenses")
+                    oldest_date = cursor.fetchone()[0] or datetime.now()
+                    definitions = partition_definitions(month_start(oldest_date), last_month)
+                    print("Partitioning the expenses table by month (one-off table rebuild)")
+                    # MySQL requires the partitioning column in every unique key
+                    cursor.execute("""ALTER TABLE expenses DROP PRIMARY KEY, ADD PRIMARY KEY (id, date),
+                                      DROP INDEX expenses_dedup_key,
+                                      ADD UNIQUE INDEX expenses_dedup_key (dedup_key, date)""")
+                    cursor.execute(f"""ALTER TABLE expenses PARTITION BY RANGE COLUMNS(date)
+                                       ({', '.join(definitions)}, PARTITION pmax VALUES LESS THAN (MAXVALUE))""")
                 cursor.close()
-                return True
-            except Error as e:
-                print(f"Error saving expense: {e}")
-                return False
-        return False
+        except Error as e:
+            print(f"Error maintaining expense partitions: {e}")
+
+    def archive_partitions(self, archive_date):
+        """Archive every monthly partition that lies wholly before archive_date
+        
+        Each partition is swapped into a staging table with EXCHANGE PARTITION and then
+        dropped, so the expenses table never runs a large DELETE
+        """
+        archived_total = 0
+        try:
+            with self.database_connection() as connection:
+                cursor = connection.cursor()
+                # A previous run may have stopped after swapping a partition out
+                archived_total += self.move_exchanged_rows(connection, cursor)
+
+                for name in self.expense_partition_names(cursor):
+                    if name == 'pmax' or add_months(partition_month(name), 1) > month_start(archive_date):
+                        break
+                    cursor.execute("CREATE TABLE expenses_exchange LIKE expenses")
+                    cursor.execute("ALTER TABLE expenses_exchange REMOVE PARTITIONING")
+                    cursor.execute(f"ALTER TABLE expenses EXCHANGE PARTITION {name} WITH TABLE expenses_exchange")
+                    archived_total += self.move_exchanged_rows(connection, cursor)
+                    cursor.execute(f"ALTER TABLE expenses DROP PARTITION {name}")
+                    print(f"Archived partition {name} ({archived_total} expenses so far)")
+                cursor.close()
+        except Error as e:
+            print(f"Error archiving expense partitions: {e}")
+        return archived_total
+
+    def move_exchanged_rows(self, connection, cursor):
+        """Copy rows from the staging table into archived_expenses and drop the staging table
+        
+        The staging table is only dropped once every row in it is in archived_expenses;
+        otherwise an Error is raised and it is left for the next run to retry.
+        """
+        cursor.execute("SHOW TABLES LIKE 'expenses_exchange'")
+        if not cursor.fetchall():
+            return 0
+        # Rows already copied before an interruption are skipped; any other failure stops the run
+        cursor.execute(f"""INSERT INTO archived_expenses ({self.ARCHIVE_COLUMNS})
+                           SELECT {self.ARCHIVE_SOURCE_COLUMNS} FROM expenses_exchange e
+                           WHERE NOT EXISTS (SELECT 1 FROM archived_expenses a WHERE a.expense_id = e.id)""")
+        moved = cursor.rowcount
+        connection.commit()
+
+        cursor.execute("SELECT COUNT(*) FROM expenses_exchange")
+        staged = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM expenses_exchange e JOIN archived_expenses a ON a.expense_id = e.id")
+        archived = cursor.fetchone()[0]
+        if archived != staged:
+            raise Error(msg=f"only {archived} of the {staged} expenses in expenses_exchange are in "
+                            "archived_expenses; keeping expenses_exchange and its partition")
+        cursor.execute("DROP TABLE expenses_exchange")
+        return moved
 
     def validate_expense(self, expense_data):
         """Validate expense data before saving"""
-        try:
-            # Check if amount is positive
-            if not isinstance(expense_data['amount'], (int, float)) or expense_data['amount'] <= 0:
-                return False, "Amount must be positive"
-            
-            # Check if category is valid
-            if expense_data['category'] not in self.valid_categories:
-                return False, "Invalid category"
-            
-            # Check if description exists
-            if not expense_data['description'].strip():
-                return False, "Description cannot be empty"
-            
-            return True, ""
-        except KeyError as error:
-            return False, f"Missing required field: {str(error)}"
+        _, error_codes = self.validate_expenses([expense_data])
+        if error_codes[0]:
+            return False, VALIDATION_ERRORS[error_codes[0]]
+        return True, ""
+
+    def validate_expenses(self, expense_batch, sources=None):
+        """Coerce and validate a whole batch of expenses in one pass
+        
+        Accepts a list of expense dicts or a columnar dict of equal-length lists. Returns
+        (records, error_codes): a cleaned copy of each valid expense and a VALIDATION_ERRORS
+        code for each invalid one, with None in the other list at the same position.
+        Amounts may be numbers, Decimals or numeric strings; dates may be ISO strings.
+        Expenses already saved (same client_id, or same record of the same source file) are
+        rejected as duplicates; sources names the record each expense was read from, if any.
+        """
+        if isinstance(expense_batch, dict):
+            field_names = list(expense_batch)
+            expense_batch = [dict(zip(field_names, values)) for values in zip(*expense_batch.values())]
+
+        # Resolve categories against one snapshot of the table instead of per record
+        use_table = self.category_cache.is_loaded()
+        category_ids = self.category_cache.current() if use_table else {}
+        valid_categories = self.valid_categories
+        infinity = math.inf
+        batch_keys = set()
+
+        records = []
+        error_codes = []
+        for expense_data, source in zip(expense_batch, sources or itertools.repeat(None)):
+            if type(expense_data) is not dict:
+                records.append(None)
+                error_codes.append('not_an_object')
+                continue
+
+            amount = expense_data.get('amount')
+            category = expense_data.get('category')
+            description = expense_data.get('description')
+            expense_date = expense_data.get('date')
+            user_id = expense_data.get('user_id')
+            error_code = None
+
+            if amount is None:
+                error_code = 'missing_amount'
+            elif category is None:
+                error_code = 'missing_category'
+            elif description is None:
+                error_code = 'missing_description'
+            elif expense_date is None:
+                error_code = 'missing_date'
+            else:
+                # Amount: a positive, finite number (bools are rejected even though they are ints)
+                amount_type = type(amount)
+                if amount_type is not float and amount_type is not int:
+                    try:
+                        amount = float(amount) if amount_type is str or amount_type is Decimal else None
+                    except ValueError:
+                        amount = None
+                if amount is None or not 0 < amount < infinity:
+                    error_code = 'invalid_amount'
+
+            category_id = None
+            if error_code is None:
+                if type(category) is not str:
+                    # Lists and dicts from JSON cannot even be looked up
+                    error_code = 'invalid_category'
+                elif use_table:
+                    category_id = category_ids.get(category)
+                    if category_id is None:
+                        # Reloads the table if the category might be new
+                        category_id = self.category_cache.category_id(category)
+                        if category_id is None:
+                            error_code = 'invalid_category'
+                elif category not in valid_categories:
+                    error_code = 'invalid_category'
+
+            if error_code is None:
+                if type(description) is not str or not description.strip():
+                    error_code = 'empty_description'
+                else:
+                    description = description.strip()
+
+            if error_code is None:
+                if type(expense_date) is str:
+                    try:
+                        expense_date = datetime.fromisoformat(expense_date)
+                    except ValueError:
+                        error_code = 'invalid_date'
+                elif not isinstance(expense_date, date):
+                    error_code = 'invalid_date'
+                if error_code is None and isinstance(expense_date, datetime):
+                    # MySQL DATETIME has no time zone, so store UTC
+                    expense_date = naive_utc(expense_date)
+
+            if error_code is None and user_id is not None:
+                if type(user_id) is str and user_id.isdigit():
+                    user_id = int(user_id)
+                if type(user_id) is not int or user_id <= 0:
+                    error_code = 'invalid_user_id'
+
+            dedup_key = None
+            if error_code is None:
+                dedup_key = expense_dedup_key(expense_data.get('client_id'), source, amount, category,
+                                              description, expense_date, user_id)
+                if dedup_key is not None:
+                    if dedup_key in batch_keys or dedup_key in self.dedup_cache:
+                        error_code = 'duplicate'
+                    else:
+                        batch_keys.add(dedup_key)
+
+            if error_code:
+                records.append(None)
+                error_codes.append(error_code)
+                continue
+
+            record = dict(expense_data)
+            record['amount'] = amount
+            record['category_id'] = category_id
+            record['description'] = description
+            record['date'] = expense_date
+            record['dedup_key'] = dedup_key
+            if user_id is not None:
+                record['user_id'] = user_id
+            records.append(record)
+            error_codes.append(None)
+        return records, error_codes
 
     def add_expense(self, expense_data):
         """Add a new expense after validation"""
-        is_valid, error_message = self.validate_expense(expense_data)
+        is_valid, error_message = self.add_expenses([expense_data])[0]
         if not is_valid:
             print(f"Error: {error_message}")
-            return False
+        return is_valid
+
+    def add_expenses(self, expense_batch, sources=None):
+        """Validate and save a batch of expenses, returning (success, error_message) per expense"""
+        records, error_codes = self.validate_expenses(expense_batch, sources)
+        results = [(False, VALIDATION_ERRORS[error_code]) if error_code else (True, "")
+                   for error_code in error_codes]
+        valid_records = [record for record in records if record is not None]
+        with self.summary_engine.writing():
+            saved_any = self.apply_save_results(records, results, self.store_expenses(valid_records))
+        # One summary rewrite for the whole batch, after the write so it is free to reconcile
+        if saved_any:
+            self.request_summary_update()
+        return results
+
+    def apply_save_results(self, records, results, save_errors):
+        """Apply the saved expenses and fill in results with the outcome of each save
         
-        if self.save_expense(expense_data):
-            self.load_expenses()  # Reload expenses from database
+        Returns whether any expense was saved, so the caller can request one summary update.
+        """
+        save_errors = iter(save_errors)
+        saved_any = False
+        for index, record in enumerate(records):
+            if record is None:
+                continue
+            error_message = next(save_errors)
+            if error_message is SPOOLED:
+                # Accepted; it reaches the summary once the spool is replayed into the database
+                results[index] = (True, SPOOLED)
+            elif error_message:
+                results[index] = (False, error_message)
+            else:
+                self.apply_saved_expense(record)
+                saved_any = True
+        return saved_any
+
+    def request_summary_update(self):
+        """Ask for the summary file to be rewritten, coalescing bursts when a scheduler is running"""
+        if self.summary_scheduler:
+            self.summary_scheduler.mark_dirty()
+        else:
             self.update_summary()
+
+    def close(self):
+        """Drain the spool, save the startup snapshot and flush the pending summary write"""
+        if self.reconnector:
+            self.reconnector.stop()
+        if self.spool:
+            self.spool.stop()
+        self.save_snapshot()
+        if self.summary_scheduler:
+            self.summary_scheduler.stop()
+
+    def apply_saved_expense(self, expense_data):
+        """Apply a saved expense as a delta instead of reloading the whole table"""
+        if expense_data.get('dedup_key'):
+            self.dedup_cache.add(expense_data['dedup_key'])
+        expense = self.stored_expense(expense_data)
+        with self.expense_lock:
+            self.expense_list.appendleft(expense)
+        self.summary_engine.apply_expense(expense)
+
+    def publish_change(self, change):
+        """Push a summary change to the event stream clients, if there are any"""
+        if self.event_bus.has_subscribers():
+            self.event_bus.publish(change['type'], change)
+
+    def reconcile_summary(self):
+        """Recalculate the running totals from MySQL to correct any drift"""
+        if not self.db_pool:
+            return False
+
+        try:
+            with self.summary_engine.reconciling_totals():
+                with self.database_connection() as connection:
+                    # Calculate total amount
+                    with self.statement_cursor(connection, self.TOTAL_QUERY) as cursor:
+                        cursor.execute(self.TOTAL_QUERY)
+                        total_amount, expense_count = cursor.fetchall()[0]
+
+                    # Calculate category totals
+                    with self.statement_cursor(connection, self.CATEGORY_TOTALS_QUERY) as cursor:
+                        cursor.execute(self.CATEGORY_TOTALS_QUERY)
+                        category_rows = cursor.fetchall()
+
+                self.reset_summary(total_amount, expense_count, category_rows)
             return True
-        return False
+        except Error as e:
+            print(f"Error reconciling summary: {e}")
+            return False
+
+    def reset_summary(self, total_amount, expense_count, category_rows):
+        """Replace the running totals with the results of TOTAL_QUERY and CATEGORY_TOTALS_QUERY"""
+        category_totals = {self.category_cache.category_name(category_id): total
+                           for category_id, total in category_rows}
+        # Missing categories are filled in with 0 by the summary engine
+        self.summary_engine.reset(total_amount, category_totals, expense_count)
 
     def calculate_summary(self):
         """Calculate expense summary including totals by category"""
-        if not self.db_connection:
+        if not self.db_pool:
             return None
 
-        try:
-            cursor = self.db_connection.cursor(dictionary=True)
-            
-            # Calculate total amount
-            cursor.execute("SELECT SUM(amount) as total FROM expenses")
-            total_result = cursor.fetchone()
-            total_amount = total_result['total'] if total_result['total'] else 0
-
-            # Calculate category totals
-            cursor.execute("""
-                SELECT category, SUM(amount) as total 
-                FROM expenses 
-                GROUP BY category
-            """)
-            category_totals = {row['category']: row['total'] for row in cursor.fetchall()}
-            
-            # Fill in missing categories with 0
-            for category in self.valid_categories:
-                if category not in category_totals:
-                    category_totals[category] = 0
-
-            cursor.close()
-            
-            return {
-                'total_amount': total_amount,
-                'category_totals': category_totals,
-                'expenses': self.expense_list
-            }
-        except Error as e:
-            print(f"Error calculating summary: {e}")
-            return None
+        if self.summary_mode == 'memory':
+            return self.memory_summary()
+
+        # Only go back to MySQL when the reconcile interval has elapsed
+        if self.summary_mode == 'sql' or self.summary_engine.reconcile_due(self.reconcile_interval):
+            self.reconcile_summary()
+        return self.engine_summary()
+
+    def memory_summary(self):
+        """Summarise the expenses held in memory, with per-category, monthly and per-user breakdowns"""
+        columns, category_names = expense_columns(self.expense_list)
+        breakdown = summarize_expense_columns(columns, category_names)
+        category_totals = {category: 0.0 for category in self.valid_categories}
+        category_totals.update(breakdown['category_totals'])
+        totals = self.summary_engine.snapshot()
+        return {
+            'epoch': totals['epoch'],
+            'version': totals['version'],
+            'total_amount': breakdown['total_amount'],
+            'category_totals': category_totals,
+            'category_counts': breakdown['category_counts'],
+            'monthly_totals': breakdown['monthly_totals'],
+            'user_totals': breakdown['user_totals'],
+            'expenses': self.recent_expenses()
+        }
+
+    def engine_summary(self):
+        """Build the summary from the running totals"""
+        totals = self.summary_engine.snapshot()
+        return {
+            'epoch': totals['epoch'],
+            'version': totals['version'],
+            'total_amount': totals['total_amount'],
+            'category_totals': totals['category_totals'],
+            'expenses': self.recent_expenses()
+        }
+
+    def recent_expenses(self):
+        """Return the newest expenses for the summary file, capped by SUMMARY_RECENT_LIMIT"""
+        if self.summary_recent_limit:
+            return list(itertools.islice(self.expense_list, self.summary_recent_limit))
+        return list(self.expense_list)
 
     def update_summary(self):
         """Update the summary file with current data"""
-        summary_data = self.calculate_summary()
-        if summary_data:
-            with open(self.summary_file, 'w') as file:
-                json.dump(summary_data, file, indent=2)
+        with self.summary_lock:
+            summary_data = self.calculate_summary()
+            if summary_data:
+                try:
+                    self.write_summary_file(summary_data)
+                except Exception as e:
+                    print(f"Error writing summary file: {e}")
+
+    def changes_since(self, epoch, version):
+        """Return the summary changes after version as a dict for clients catching up
+        
+        'reset' is set instead of 'changes' when the client must reload the whole summary:
+        the tracker has restarted since (a different epoch) or the change log has moved on.
+        """
+        changes = None
+        if epoch == self.summary_engine.epoch:
+            changes = self.summary_engine.changes_since(version)
+        totals = self.summary_engine.snapshot()
+        response = {'epoch': totals['epoch'], 'version': totals['version']}
+        if changes is None:
+            response['reset'] = True
+        else:
+            response['changes'] = changes
+            if changes:
+                response['version'] = changes[-1]['version']
+        return response
+
+    def summary_response(self):
+        """Return the current summary as compact JSON with its ETag, encoding it only after a change
+        
+        Returns None when there is no summary to serve (no database connection).
+        """
+        # Read the version first: a change made while encoding leaves the cache stale, never wrong
+        version = self.summary_engine.version
+        cached = self.summary_cache
+        if cached and cached['version'] == version:
+            return cached
+        with self.summary_lock:
+            summary_data = self.calculate_summary()
+        return self.cache_summary_response(version, summary_data)
+
+    def cache_summary_response(self, version, summary_data):
+        """Encode a summary for HTTP and keep it until the totals move past version"""
+        if summary_data is None:
+            return None
+        body = json.dumps(summary_data, separators=(',', ':'), default=json_default).encode('utf-8')
+        cached = {
+            'version': version,
+            'etag': f'"{hashlib.sha1(body).hexdigest()}"',
+            'body': body,
+            'gzip_body': gzip.compress(body, compresslevel=5)
+        }
+        self.summary_cache = cached
+        return cached
+
+    def write_summary_file(self, summary_data):
+        """Stream the summary to temporary files and rename them into place
+        
+        The browser never sees a half-written file because os.replace is atomic
+        """
+        if self.summary_format == 'compact':
+            encoder = json.JSONEncoder(separators=(',', ':'), default=json_default)
+        else:
+            encoder = json.JSONEncoder(indent=2, default=json_default)
+
+        temp_file = f"{self.summary_file}.tmp"
+        gzip_file = f"{self.summary_file}.gz"
+        temp_gzip_file = f"{gzip_file}.tmp"
+        with open(temp_file, 'w') as file:
+            gzip_output = gzip.open(temp_gzip_file, 'wt', compresslevel=5) if self.summary_gzip else None
+            try:
+                for chunk in encoder.iterencode(summary_data):
+                    file.write(chunk)
+                    if gzip_output:
+                        gzip_output.write(chunk)
+            finally:
+                if gzip_output:
+                    gzip_output.close()
+        os.replace(temp_file, self.summary_file)
+        if self.summary_gzip:
+            os.replace(temp_gzip_file, gzip_file)
+
+def json_default(value):
+    """Convert the MySQL column types json cannot serialise on its own"""
+    if isinstance(value, datetime):
+        return utc_isoformat(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def utc_isoformat(value):
+    """Format a datetime with its +00:00 offset; naive ones are the UTC stored in DATETIME columns
+    
+    Without the offset browsers read the time as local and show it shifted.
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+def naive_utc(value):
+    """Convert an aware datetime to the naive UTC that DATETIME columns store; naive ones are already UTC"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def json_cut_off(error, buffer):
+    """Check whether a decode error may only be a record cut off at the end of the buffer
+    
+    A string running to the end of the buffer, or a short number, literal or escape at
+    its very end, can still be completed by the next chunk; anything else is bad JSON.
+    """
+    if error.msg.startswith('Unterminated string'):
+        return True
+    tail = buffer[error.pos:]
+    return len(tail) <= 16 and all(character.isalnum() or character in '+-.\\' for character in tail)
+
+def iter_json_records(file_path, chunk_size=65536):
+    """Yield (record, error message) for each record of a JSON array, NDJSON or single-object file
+    
+    The file is read in chunks so bulk imports never have to fit in memory. NDJSON is decoded
+    a line at a time, so a bad line is yielded as (None, message) and the lines after it are
+    still read. Nothing after a syntax error in an array or a multi-line object can be
+    trusted, so that raises ValueError.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r') as file:
+        buffer = ''
+        position = 0
+        end_of_file = False
+        record_number = 0
+        array = None
+        # Decided by the first record: True if it fits on one line, False for a multi-line document
+        line_mode = None
+        while True:
+            # Skip whitespace, newlines and the commas between array items
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+
+            if position >= len(buffer):
+                if end_of_file:
+                    return
+                buffer = file.read(chunk_size)
+                end_of_file = not buffer
+                position = 0
+                continue
+
+            if array is None:
+                array = buffer[position] == '['
+                if array:
+                    line_mode = False
+                    position += 1
+                    continue
+            if array and buffer[position] == ']':
+                return
+
+            if line_mode is not False:
+                line_end = buffer.find('\n', position)
+                if line_end < 0 and not end_of_file:
+                    # The line continues in the next chunk
+                    more = file.read(chunk_size)
+                    end_of_file = not more
+                    buffer = buffer[position:] + more
+                    position = 0
+                    continue
+                if line_end < 0:
+                    line_end = len(buffer)
+                line = buffer[position:line_end]
+                try:
+                    record, record_end = decoder.raw_decode(line)
+                    if line[record_end:].strip(' \t\r,'):
+                        raise json.JSONDecodeError("Extra data", line, record_end)
+                except json.JSONDecodeError as e:
+                    if line_mode is None:
+                        # Not a one-line record, so the file is a single multi-line object
+                        line_mode = False
+                        continue
+                    record_number += 1
+                    position = line_end
+                    yield None, f"Invalid JSON: {e.msg} at column {e.colno}"
+                    continue
+                line_mode = True
+                record_number += 1
+                position = line_end
+                yield record, None
+                continue
+
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if end_of_file or not json_cut_off(e, buffer):
+                    raise ValueError(f"invalid JSON in record {record_number + 1}: {e.msg}") from None
+                # The record continues in the next chunk
+                more = file.read(chunk_size)
+                end_of_file = not more
+                buffer = buffer[position:] + more
+                position = 0
+                continue
+            record_number += 1
+            yield record, None
+
+class ExpenseBatcher:
+    """Coalesce expense files that arrive close together into a single database write"""
+    def __init__(self, expense_tracker):
+        self.expense_tracker = expense_tracker
+        # Flush when this many expenses are pending or the oldest has waited this many seconds
+        self.batch_size = int(os.getenv('INGEST_BATCH_SIZE', '100'))
+        self.batch_window = float(os.getenv('INGEST_BATCH_WINDOW', '0.25'))
+        self.lock = threading.Lock()
+        self.pending = []
+        self.flush_timer = None
+
+    def add(self, source_path, expense_data, source=None):
+        """Queue an expense read from source_path (identified by source), writing the batch once it is full"""
+        batch = None
+        with self.lock:
+            self.pending.append((source_path, expense_data, source))
+            if len(self.pending) >= self.batch_size:
+                batch = self.take_pending()
+            elif self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.batch_window, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+        if batch:
+            self.write_batch(batch)
+
+    def flush(self):
+        """Write whatever is pending right now"""
+        with self.lock:
+            batch = self.take_pending()
+        self.write_batch(batch)
+
+    def take_pending(self):
+        """Detach the pending batch; the caller must hold self.lock"""
+        if self.flush_timer:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        batch, self.pending = self.pending, []
+        return batch
+
+    def write_batch(self, batch):
+        """Save a batch, report failures per file and clean up the processed files"""
+        if not batch:
+            return
+        results = self.expense_tracker.add_expenses([expense_data for _, expense_data, _ in batch],
+                                                    [source for _, _, source in batch])
+        for (source_path, _, _), (is_valid, error_message) in zip(batch, results):
+            if not is_valid:
+                print(f"Error in {source_path}: {error_message}")
+            try:
+                os.remove(source_path)
+            except FileNotFoundError:
+                pass
 
 class NewExpenseHandler(FileSystemEventHandler):
     """Handle new expense file events"""
+    # Files holding many expenses as a JSON array or newline-delimited JSON
+    BULK_FILE_SUFFIXES = ('new_expenses.json', '.ndjson')
+    # Claimed files are renamed to <name>.<pid>.<random hex>.processing while they are ingested;
+    # earlier versions used <name>.<counter>.processing
+    CLAIM_PATTERN = re.compile(r'(?P<source>.+?)\.(?:\d+\.[0-9a-f]{32}|\d+)\.processing')
+
     def __init__(self, expense_tracker):
         self.expense_tracker = expense_tracker
+        self.batcher = ExpenseBatcher(expense_tracker)
+        # Size polling settings for platforms that do not report closed files
+        self.poll_interval = float(os.getenv('WRITE_POLL_INTERVAL', '0.05'))
+        self.write_timeout = float(os.getenv('WRITE_STABLE_TIMEOUT', '10'))
+        self.fallback_delay = float(os.getenv('WRITE_FALLBACK_DELAY', '1'))
+        self.close_events_seen = False
+
+        # Database work runs on a pool of worker threads so it never blocks the observer;
+        # a full queue makes the observer wait (backpressure) instead of growing without limit
+        self.work_queue = queue.Queue(maxsize=int(os.getenv('INGEST_QUEUE_SIZE', '1000')))
+        self.workers = []
+        for worker_number in range(max(1, int(os.getenv('INGEST_WORKERS', '4')))):
+            worker = threading.Thread(target=self.run_worker, name=f"expense-worker-{worker_number}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, task, file_path):
+        """Queue a file for the worker pool, waiting while the queue is full"""
+        self.work_queue.put((task, file_path))
+
+    def run_worker(self):
+        """Process queued files until shutdown() sends the stop signal"""
+        while True:
+            work_item = self.work_queue.get()
+            try:
+                if work_item is None:
+                    return
+                task, file_path = work_item
+                task(file_path)
+            except Exception as error:
+                print(f"Error processing {file_path}: {str(error)}")
+            finally:
+                self.work_queue.task_done()
+
+    def shutdown(self):
+        """Finish every queued file, stop the workers and write the last batch"""
+        for _ in self.workers:
+            self.work_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.batcher.flush()
+
+    def is_expense_file(self, file_path):
+        """Check whether a path is a single or bulk expense file"""
+        return file_path.endswith('new_expense.json') or file_path.endswith(self.BULK_FILE_SUFFIXES)
+
+    def on_closed(self, event):
+        """A file closed after writing is complete, so process it straight away"""
+        self.close_events_seen = True
+        if self.is_expense_file(event.src_path):
+            self.submit(self.process_file, event.src_path)
+
+    def on_moved(self, event):
+        """Writers can write a *.tmp file and rename it into place atomically"""
+        if self.is_expense_file(event.dest_path):
+            self.submit(self.process_file, event.dest_path)
 
     def on_created(self, event):
-        """Process new expense files when they're created"""
-        if event.src_path.endswith('new_expense.json'):
+        """Fall back to waiting for the file size to settle when close events are unavailable"""
+        if not self.is_expense_file(event.src_path):
+            return
+        if self.close_events_seen:
+            # on_closed will normally get there first; this catches files moved in from elsewhere
+            fallback_timer = threading.Timer(self.fallback_delay, self.submit,
+                                             args=(self.process_when_stable, event.src_path))
+            fallback_timer.daemon = True
+            fallback_timer.start()
+        else:
+            self.submit(self.process_when_stable, event.src_path)
+
+    def process_when_stable(self, file_path):
+        """Process a file once its size stops changing"""
+        if self.wait_for_complete_write(file_path):
+            self.process_file(file_path)
+
+    def wait_for_complete_write(self, file_path):
+        """Poll the file size until two consecutive reads agree"""
+        deadline = time.monotonic() + self.write_timeout
+        last_size = -1
+        while time.monotonic() < deadline:
+            try:
+                size = os.path.getsize(file_path)
+            except FileNotFoundError:
+                # Already picked up by another event
+                return False
+            if size > 0 and size == last_size:
+                return True
+            last_size = size
+            time.sleep(self.poll_interval)
+        print(f"Error processing {file_path}: file was still being written after {self.write_timeout}s")
+        return False
+
+    def claim_path(self, file_path):
+        """Name a claimed file uniquely, so a claim never overwrites one left by an earlier run"""
+        return f"{file_path}.{os.getpid()}.{uuid.uuid4().hex}.processing"
+
+    def process_file(self, file_path):
+        """Claim an expense file and hand it to the single or bulk ingestion path"""
+        # Renaming claims the file, so overlapping events can never process it twice
+        claimed_path = self.claim_path(file_path)
+        try:
+            os.rename(file_path, claimed_path)
+        except FileNotFoundError:
+            return
+        self.process_claimed_file(file_path, claimed_path)
+
+    def recover_claimed_files(self, directory):
+        """Queue files claimed by a tracker that stopped before finishing them
+        
+        Call at startup, before any file is claimed; one tracker watches each directory.
+        Expenses from these files that were already saved are rejected as duplicates,
+        so a partly imported file can simply be ingested again.
+        """
+        for file_name in os.listdir(directory):
+            claim = self.CLAIM_PATTERN.fullmatch(file_name)
+            if not claim or not self.is_expense_file(claim['source']):
+                continue
+            print(f"Recovering {file_name} left by an interrupted run")
+            source_path = os.path.join(directory, claim['source'])
+            claimed_path = self.claim_path(source_path)
             try:
-                # Wait briefly to ensure file is completely written
-                time.sleep(0.1)
-                with open(event.src_path, 'r') as file:
+                os.rename(os.path.join(directory, file_name), claimed_path)
+            except FileNotFoundError:
+                continue
+            self.submit(functools.partial(self.process_claimed_file, source_path), claimed_path)
+
+    def process_claimed_file(self, file_path, claimed_path):
+        """Ingest a claimed file through the single or bulk path, by its original name"""
+        if file_path.endswith('new_expense.json'):
+            try:
+                with open(claimed_path, 'r') as file:
                     expense_data = json.load(file)
                 
-                self.expense_tracker.add_expense(expense_data)
-                os.remove(event.src_path)
+                # The batcher saves the expense and removes the file when it flushes
+                self.batcher.add(claimed_path, expense_data, f"{file_source(claimed_path)}#1")
+            except ValueError as error:
+                self.reject_file(claimed_path, f"Error processing new expense: {str(error)}")
             except Exception as error:
                 print(f"Error processing new expense: {str(error)}")
+        else:
+            try:
+                self.import_bulk_file(claimed_path)
+            except ValueError as error:
+                self.reject_file(claimed_path, f"Error importing {file_path}: {str(error)}")
+            except Exception as error:
+                print(f"Error importing {file_path}: {str(error)}")
+
+    def reject_file(self, claimed_path, message):
+        """Set aside a file that is not valid JSON, so it is not retried on every restart"""
+        rejected_path = f"{claimed_path[:-len('.processing')]}.rejected"
+        try:
+            os.rename(claimed_path, rejected_path)
+        except OSError as error:
+            print(f"{message} (could not move it aside: {error})")
+            return
+        print(f"{message}; moved to {rejected_path}")
+
+    def import_bulk_file(self, file_path):
+        """Stream a bulk expense file into the database one batch at a time
+        
+        Raises ValueError, once the records before it are saved, if the file stops being valid JSON.
+        """
+        batch = []
+        record_numbers = []
+        imported = rejected = 0
+        # Records are deduplicated by file and record number, so only a rerun of the same file repeats them
+        source = file_source(file_path)
+        try:
+            for record_number, (record, error_message) in enumerate(iter_json_records(file_path), start=1):
+                if error_message is None and not isinstance(record, dict):
+                    error_message = VALIDATION_ERRORS['not_an_object']
+                if error_message:
+                    print(f"Error in {file_path} record {record_number}: {error_message}")
+                    rejected += 1
+                    continue
+                batch.append(record)
+                record_numbers.append(record_number)
+                if len(batch) >= self.batcher.batch_size:
+                    saved = self.write_records(file_path, source, batch, record_numbers)
+                    imported += saved
+                    rejected += len(batch) - saved
+                    batch, record_numbers = [], []
+        finally:
+            if batch:
+                saved = self.write_records(file_path, source, batch, record_numbers)
+                imported += saved
+                rejected += len(batch) - saved
+
+        os.remove(file_path)
+        print(f"Imported {imported} expenses from {file_path} ({rejected} rejected)")
+
+    def write_records(self, file_path, source, batch, record_numbers):
+        """Save one batch from a bulk file and report failures by record number"""
+        saved = 0
+        results = self.expense_tracker.add_expenses(batch, [f"{source}#{number}" for number in record_numbers])
+        for record_number, (is_valid, error_message) in zip(record_numbers, results):
+            if is_valid:
+                saved += 1
+            else:
+                print(f"Error in {file_path} record {record_number}: {error_message}")
+        return saved
+
+class AsyncExpenseDatabase:
+    """Asyncio connection pool over aiomysql, or over aiosqlite as a stand-in without a MySQL server
+    
+    Queries are written with %s placeholders as for mysql.connector and rewritten for SQLite.
+    Connections run with autocommit off, so statements up to commit() form one transaction.
+    """
+    DRIVERS = ('aiomysql', 'aiosqlite')
+
+    def __init__(self, driver, pool_size):
+        self.driver = driver
+        self.pool_size = pool_size
+        self.pool = None
+        self.idle_connections = None
+        modules = {'aiomysql': aiomysql, 'aiosqlite': aiosqlite}
+        self.module = modules.get(driver)
+        # Driver errors (both re-export the DB-API exception classes)
+        self.Error = self.module.Error if self.module else Exception
+
+    async def connect(self):
+        """Open the pool, returning False if it cannot be opened"""
+        if self.driver not in self.DRIVERS:
+            print(f"Unknown ASYNC_DB_DRIVER {self.driver!r}, expected one of {', '.join(self.DRIVERS)}")
+            return False
+        if self.module is None:
+            print(f"{self.driver} is not installed")
+            return False
+        try:
+            if self.driver == 'aiomysql':
+                self.pool = await aiomysql.create_pool(
+                    host=os.getenv('DB_HOST', 'localhost'),
+                    db=os.getenv('DB_NAME', 'expense_tracker'),
+                    user=os.getenv('DB_USER'),
+                    password=os.getenv('DB_PASSWORD', ''),
+                    minsize=1,
+                    maxsize=self.pool_size,
+                    autocommit=False
+                )
+            else:
+                self.idle_connections = asyncio.Queue()
+                for _ in range(self.pool_size):
+                    connection = await aiosqlite.connect(
+                        os.getenv('ASYNC_SQLITE_PATH', os.getenv('SQLITE_PATH', 'expense_tracker.db')))
+                    # Readers do not block the writer, and writers wait for each other instead of failing
+                    await connection.execute("PRAGMA journal_mode=WAL")
+                    await connection.execute("PRAGMA busy_timeout=5000")
+                    self.idle_connections.put_nowait(connection)
+        except (self.Error, OSError) as e:
+            print(f"Error connecting to the database with {self.driver}: {e}")
+            return False
+        print(f"Connected to the database with {self.driver}")
+        return True
+
+    @asynccontextmanager
+    async def connection(self):
+        """Borrow a connection for the duration of an async with block"""
+        if self.pool is not None:
+            async with self.pool.acquire() as connection:
+                yield connection
+            return
+        connection = await self.idle_connections.get()
+        try:
+            yield connection
+        finally:
+            self.idle_connections.put_nowait(connection)
+
+    def prepare(self, query):
+        """Rewrite %s placeholders for drivers that use ?"""
+        return query.replace('%s', '?') if self.driver == 'aiosqlite' else query
+
+    async def execute(self, connection, query, params=(), dictionary=False):
+        """Run one statement and return its rows, as dicts when dictionary is set"""
+        cursor = await connection.cursor()
+        try:
+            await cursor.execute(self.prepare(query), params)
+            if cursor.description is None:
+                return []
+            rows = await cursor.fetchall()
+            if dictionary:
+                names = [column[0] for column in cursor.description]
+                return [dict(zip(names, row)) for row in rows]
+            return [tuple(row) for row in rows]
+        finally:
+            await cursor.close()
+
+    async def executemany(self, connection, query, rows):
+        """Run one statement for every row of parameters, returning the first inserted id
+        
+        aiomysql sends an INSERT as one multi-row statement and reports its first id as lastrowid;
+        aiosqlite runs it row by row, one writer at a time, so its ids are consecutive.
+        """
+        cursor = await connection.cursor()
+        try:
+            await cursor.executemany(self.prepare(query), rows)
+            if self.driver == 'aiosqlite':
+                await cursor.execute("SELECT last_insert_rowid()")
+                last_row_id, = await cursor.fetchone()
+                return last_row_id - len(rows) + 1
+            return cursor.lastrowid
+        finally:
+            await cursor.close()
+
+    async def insert(self, connection, query, params):
+        """Run one INSERT, returning the id of the new row"""
+        cursor = await connection.cursor()
+        try:
+            await cursor.execute(self.prepare(query), params)
+            return cursor.lastrowid
+        finally:
+            await cursor.close()
+
+    def is_duplicate(self, error):
+        """Check whether an error is a unique key violation"""
+        if self.driver == 'aiosqlite':
+            return isinstance(error, aiosqlite.IntegrityError) and 'UNIQUE' in str(error)
+        return bool(error.args) and error.args[0] == errorcode.ER_DUP_ENTRY
+
+    def is_disconnect(self, error):
+        """Check whether an error means the server went away"""
+        return (self.driver == 'aiomysql' and bool(error.args) and
+                error.args[0] in (errorcode.CR_SERVER_GONE_ERROR, errorcode.CR_SERVER_LOST))
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+        elif self.idle_connections is not None:
+            while not self.idle_connections.empty():
+                await self.idle_connections.get_nowait().close()
+
+async def acquire_off_loop(acquire, release):
+    """Call a blocking acquire on a worker thread, releasing it again if the caller is cancelled meanwhile
+    
+    Cancelling the await does not stop the thread, so the gate would otherwise be taken and never released.
+    """
+    lock = threading.Lock()
+    acquired = abandoned = False
+
+    def run():
+        nonlocal acquired
+        acquire()
+        with lock:
+            if abandoned:
+                release()
+            else:
+                acquired = True
+
+    try:
+        await asyncio.to_thread(run)
+    except asyncio.CancelledError:
+        with lock:
+            abandoned = True
+            # The thread may have finished just before the cancellation reached this task
+            if acquired:
+                release()
+        raise
+
+class AsyncExpenseTracker:
+    """Asyncio versions of the tracker's database operations, sharing its in-memory state
+    
+    Validation, the running totals, the expense store and the caches belong to the
+    ExpenseTracker; only the queries run on an AsyncExpenseDatabase, so one event loop
+    can keep many of them in flight while it serves ingest and reads.
+    """
+    def __init__(self, expense_tracker, database, archive_at_startup=True):
+        self.expense_tracker = expense_tracker
+        self.database = database
+        self.archive_at_startup = archive_at_startup
+        self.archive_task = None
+
+    async def connect(self):
+        """Open the pool, load state through it if the blocking pool could not, and start archiving"""
+        if not await self.database.connect():
+            return False
+        if not self.expense_tracker.db_pool:
+            await self.load_categories()
+            await self.load_expenses()
+            await self.reconcile_summary()
+        self.archive_task = asyncio.create_task(self.run_archive_schedule())
+        return True
+
+    async def close(self):
+        if self.archive_task:
+            self.archive_task.cancel()
+            # Lets the archive run unwind before its connections are closed under it
+            await asyncio.gather(self.archive_task, return_exceptions=True)
+        await self.database.close()
+
+    async def load_categories(self):
+        """Read the categories table into the tracker's category cache"""
+        try:
+            async with self.database.connection() as connection:
+                rows = await self.database.execute(connection, "SELECT category_id, name FROM categories")
+        except self.database.Error as e:
+            print(f"Error loading categories: {e}")
+            return
+        self.expense_tracker.category_cache.load_rows(rows)
+        self.expense_tracker.use_loaded_categories()
+
+    async def load_expenses(self):
+        """Load existing expenses from the database, newest first, one page at a time"""
+        expense_tracker = self.expense_tracker
+        expense_tracker.expense_list = expense_tracker.new_expense_store()
+        window_start = expense_tracker.expense_window_start()
+        try:
+            async with self.database.connection() as connection:
+                last_row = None
+                while True:
+                    page_size = expense_tracker.next_page_size()
+                    if page_size <= 0:
+                        break
+                    page = await self.database.execute(
+                        connection, *expense_tracker.expense_page_query(window_start, last_row, page_size),
+                        dictionary=True)
+                    expense_tracker.add_loaded_page(page)
+                    if len(page) < page_size:
+                        break
+                    last_row = page[-1]
+        except self.database.Error as e:
+            print(f"Error loading expenses: {e}")
+            expense_tracker.expense_list = expense_tracker.new_expense_store()
+
+    async def save_expenses(self, expense_batch):
+        """Save a batch of expenses in one transaction, like ExpenseTracker.save_expenses"""
+        if not expense_batch:
+            return []
+        database = self.database
+        query = ExpenseTracker.INSERT_EXPENSE_QUERY
+        # Resolving a category id can reload the categories table through the blocking pool
+        rows = await asyncio.to_thread(self.expense_tracker.expense_rows, expense_batch)
+        try:
+            async with database.connection() as connection:
+                if len(rows) > 1:
+                    try:
+                        first_id = await database.executemany(connection, query, rows)
+                        await self.read_batch_ids(connection, expense_batch, first_id)
+                        await connection.commit()
+                        return [None] * len(rows)
+                    except database.Error as e:
+                        await connection.rollback()
+                        print(f"Error saving expense batch, retrying row by row: {e}")
+
+                # Insert the rows one at a time so each failure is reported against its own row
+                errors = []
+                for expense_data, row in zip(expense_batch, rows):
+                    try:
+                        expense_data['id'] = await database.insert(connection, query, row)
+                        await connection.commit()
+                        errors.append(None)
+                    except database.Error as e:
+                        await connection.rollback()
+                        if database.is_duplicate(e):
+                            errors.append(VALIDATION_ERRORS['duplicate'])
+                        elif database.is_disconnect(e):
+                            errors.append(DATABASE_UNAVAILABLE)
+                        else:
+                            errors.append(str(e))
+                return errors
+        except (database.Error, OSError) as e:
+            print(f"Error saving expenses: {e}")
+            return [DATABASE_UNAVAILABLE] * len(rows)
+
+    async def read_batch_ids(self, connection, expense_batch, first_id):
+        """Find the ids of a multi-row INSERT like ExpenseTracker.read_batch_ids"""
+        database = self.database
+        query = batch_ids_query(expense_batch, first_id)
+        if query:
+            assign_batch_ids(expense_batch, first_id, id_rows=await database.execute(connection, *query))
+            return
+        id_step = 1
+        if database.driver == 'aiomysql':
+            (id_step,), = await database.execute(connection, "SELECT @@auto_increment_increment")
+        assign_batch_ids(expense_batch, first_id, id_step=id_step)
+
+    async def add_expenses(self, expense_batch):
+        """Validate and save a batch of expenses, returning (success, error_message) per expense"""
+        expense_tracker = self.expense_tracker
+        # Validation can reload the categories table through the blocking pool; keep it off the loop
+        records, error_codes = await asyncio.to_thread(expense_tracker.validate_expenses, expense_batch)
+        results = [(False, VALIDATION_ERRORS[error_code]) if error_code else (True, "")
+                   for error_code in error_codes]
+        valid_records = [record for record in records if record is not None]
+
+        spool = expense_tracker.spool
+        summary_engine = expense_tracker.summary_engine
+        # Waits out a reconcile in progress, so it runs on a worker thread
+        await acquire_off_loop(summary_engine.begin_write, summary_engine.end_write)
+        try:
+            if spool and spool.has_backlog():
+                errors = [DATABASE_UNAVAILABLE] * len(valid_records)
+            else:
+                errors = await self.save_expenses(valid_records)
+            if DATABASE_UNAVAILABLE in errors:
+                # Spooling waits on fsync, so it runs on a worker thread
+                errors = await asyncio.to_thread(expense_tracker.spool_unsaved, valid_records, errors)
+            saved_any = await asyncio.to_thread(expense_tracker.apply_save_results, records, results, errors)
+        finally:
+            summary_engine.end_write()
+        if saved_any:
+            # With SUMMARY_INTERVAL=0 this rewrites the summary file (and may reconcile) straight away
+            await asyncio.to_thread(expense_tracker.request_summary_update)
+        return results
+
+    async def reconcile_summary(self):
+        """Recalculate the running totals from the database to correct any drift"""
+        summary_engine = self.expense_tracker.summary_engine
+        await acquire_off_loop(summary_engine.begin_reconcile, summary_engine.end_reconcile)
+        try:
+            async with self.database.connection() as connection:
+                (total_amount, expense_count), = await self.database.execute(connection, ExpenseTracker.TOTAL_QUERY)
+                category_rows = await self.database.execute(connection, ExpenseTracker.CATEGORY_TOTALS_QUERY)
+            self.expense_tracker.reset_summary(total_amount, expense_count, category_rows)
+        except self.database.Error as e:
+            print(f"Error reconciling summary: {e}")
+            return False
+        finally:
+            summary_engine.end_reconcile()
+        return True
+
+    async def calculate_summary(self):
+        """Calculate the expense summary, reconciling first when it is due"""
+        expense_tracker = self.expense_tracker
+        if expense_tracker.summary_mode == 'memory':
+            # A pass over every stored expense; keep it off the event loop
+            return await asyncio.to_thread(expense_tracker.memory_summary)
+        if (expense_tracker.summary_mode == 'sql' or
+                expense_tracker.summary_engine.reconcile_due(expense_tracker.reconcile_interval)):
+            await self.reconcile_summary()
+        return expense_tracker.engine_summary()
+
+    async def summary_response(self):
+        """Async counterpart of ExpenseTracker.summary_response"""
+        expense_tracker = self.expense_tracker
+        version = expense_tracker.summary_engine.version
+        cached = expense_tracker.summary_cache
+        if cached and cached['version'] == version:
+            return cached
+        summary_data = await self.calculate_summary()
+        return await asyncio.to_thread(expense_tracker.cache_summary_response, version, summary_data)
+
+    async def archive_old_expenses(self, archive_date):
+        """Move expenses older than archive_date to archived_expenses in primary key order
+        
+        Same batches as ExpenseTracker.archive_old_expenses; whole partitions are still
+        archived by the blocking code, on a worker thread.
+        """
+        expense_tracker = self.expense_tracker
+        database = self.database
+        archived_total = 0
+        if expense_tracker.partitioning and expense_tracker.db_pool:
+            archived_total = await asyncio.to_thread(expense_tracker.archive_partitions, archive_date)
+        last_id = 0
+        try:
+            async with database.connection() as connection:
+                while True:
+                    rows = await database.execute(connection, ExpenseTracker.ARCHIVE_SELECT_QUERY,
+                                                  (archive_date, last_id, expense_tracker.archive_batch_size))
+                    batch_ids = [row[0] for row in rows]
+                    if not batch_ids:
+                        await connection.commit()
+                        break
+
+                    batch_range = (batch_ids[0], batch_ids[-1], archive_date)
+                    await database.execute(connection, ExpenseTracker.ARCHIVE_COPY_QUERY, batch_range)
+                    await database.execute(connection, ExpenseTracker.ARCHIVE_DELETE_QUERY, batch_range)
+                    await connection.commit()
+
+                    archived_total += len(batch_ids)
+                    last_id = batch_ids[-1]
+                    print(f"Archived {archived_total} expenses older than {archive_date} (up to id {last_id})")
+                    if len(batch_ids) < expense_tracker.archive_batch_size:
+                        break
+                    await asyncio.sleep(expense_tracker.archive_batch_pause)
+        except database.Error as e:
+            print(f"Error archiving expenses: {e}")
+
+        if archived_total:
+            await asyncio.to_thread(expense_tracker.forget_archived_expenses, archive_date)
+            expense_tracker.summary_engine.record_archived(archive_date, archived_total)
+            await self.reconcile_summary()
+        return archived_total
+
+    async def run_archive_schedule(self):
+        """Archive straight away (unless skipped) and then once every interval, like ArchiveScheduler"""
+        expense_tracker = self.expense_tracker
+        interval = expense_tracker.archive_interval
+        if not self.archive_at_startup and interval <= 0:
+            return
+        delay = 0 if self.archive_at_startup else interval
+        while True:
+            await asyncio.sleep(delay)
+            if expense_tracker.partitioning and expense_tracker.db_pool:
+                await asyncio.to_thread(expense_tracker.ensure_partitions)
+            archive_threshold = datetime.now() - timedelta(days=expense_tracker.archive_retention_days)
+            await self.archive_old_expenses(archive_threshold)
+            if interval <= 0:
+                return
+            delay = interval
+
+class ExpenseHttpServer:
+    """Minimal asyncio HTTP/1.1 server for submitting expenses and reading the summary
+    
+    POST /expenses takes one expense object or an array of them; GET /expense_summary.json
+    (or /summary) serves the summary from memory with ETag/If-None-Match revalidation,
+    GET /changes?since=N&epoch=E returns only the changes after version N, and
+    GET /events streams summary changes as server-sent events.
+    The page, script and stylesheet in the working directory are served too, so the browser
+    can post to the same origin.
+    """
+    STATIC_TYPES = {
+        '.html': 'text/html; charset=utf-8',
+        '.js': 'text/javascript; charset=utf-8',
+        '.css': 'text/css; charset=utf-8'
+    }
+    INDEX_FILE = 'Expense_tracker_Ver_8a.html'
+
+    def __init__(self, expense_tracker, host, port, async_tracker=None):
+        self.expense_tracker = expense_tracker
+        self.host = host
+        self.port = port
+        # With an AsyncExpenseTracker the database is used from the event loop instead of threads
+        self.async_tracker = async_tracker
+        self.max_body = int(os.getenv('HTTP_MAX_BODY', str(16 * 1024 * 1024)))
+        # Lines are capped by the StreamReader limit (64 KiB), the number of headers here
+        self.max_headers = int(os.getenv('HTTP_MAX_HEADERS', '100'))
+        self.idle_timeout = float(os.getenv('HTTP_IDLE_TIMEOUT', '15'))
+        # Comment lines sent on idle event streams so proxies keep them open
+        self.heartbeat_interval = float(os.getenv('EVENT_HEARTBEAT_INTERVAL', '15'))
+
+    async def serve(self):
+        """Accept connections until cancelled, returning False if the server could not start"""
+        if self.async_tracker and not await self.async_tracker.connect():
+            return False
+        try:
+            try:
+                server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+            except OSError as e:
+                print(f"Error serving HTTP on {self.host}:{self.port}: {e}")
+                return False
+            print(f"Serving expenses on http://{self.host}:{self.port}/")
+            async with server:
+                await server.serve_forever()
+            return True
+        finally:
+            if self.async_tracker:
+                await self.async_tracker.close()
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one keep-alive connection"""
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), self.idle_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                if isinstance(request, HTTPStatus):
+                    # Malformed or oversized; answer and drop the connection
+                    await self.send(writer, request, self.json_body({'error': request.phrase}), close=True)
+                    break
+                method, path, query, headers, body = request
+                if method == 'GET' and path == '/events':
+                    # The stream holds the connection until the client goes away
+                    await self.stream_events(writer, headers.get('last-event-id'))
+                    break
+                status, response_body, response_headers = await self.route(method, path, query, headers, body)
+                close = headers.get('connection', '').lower() == 'close'
+                await self.send(writer, status, response_body, response_headers, close=close)
+                if close:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """Read one request, returning (method, path, query, headers, body), an error status or None at EOF"""
+        request_line = await self.read_line(reader)
+        if request_line is None:
+            return HTTPStatus.REQUEST_URI_TOO_LONG
+        if not request_line:
+            return None
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            return HTTPStatus.BAD_REQUEST
+        method, target, _ = parts
+
+        headers = {}
+        while True:
+            line = await self.read_line(reader)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if line is None or len(headers) >= self.max_headers:
+                return HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST
+        if length > self.max_body:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+        body = await reader.readexactly(length) if length else b''
+        url = urlsplit(target)
+        return method.upper(), url.path, parse_qs(url.query), headers, body
+
+    @staticmethod
+    async def read_line(reader):
+        """Read one line, or return None if it is longer than the reader's limit"""
+        try:
+            return await reader.readline()
+        except ValueError:
+            # readline() turns LimitOverrunError into ValueError
+            return None
+
+    async def route(self, method, path, query, headers, body):
+        """Dispatch a request, returning (status, body, extra headers)"""
+        if path in ('/summary', '/expense_summary.json'):
+            if method != 'GET':
+                return self.method_not_allowed('GET')
+            return await self.get_summary(headers)
+        if path == '/expenses':
+            if method != 'POST':
+                return self.method_not_allowed('POST')
+            # Browsers only send JSON cross-origin after a CORS preflight, which this server
+            # never grants, so other web pages cannot post expenses to the local tracker
+            if headers.get('content-type', '').partition(';')[0].strip().lower() != 'application/json':
+                return (HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+                        self.json_body({'error': "Content-Type must be application/json"}), {})
+            return await self.post_expenses(body)
+        if path == '/changes':
+            if method != 'GET':
+                return self.method_not_allowed('GET')
+            return self.get_changes(query)
+        if method == 'GET':
+            return self.get_static_file(path)
+        return HTTPStatus.NOT_FOUND, self.json_body({'error': "Not found"}), {}
+
+    def method_not_allowed(self, allowed):
+        return HTTPStatus.METHOD_NOT_ALLOWED, self.json_body({'error': "Method not allowed"}), {'Allow': allowed}
+
+    async def get_summary(self, headers):
+        """Serve the in-memory summary, or 304 when the client already has this version"""
+        if self.async_tracker:
+            summary = await self.async_tracker.summary_response()
+        else:
+            # Encoding can reconcile against MySQL, so keep it off the event loop
+            loop = asyncio.get_running_loop()
+            summary = await loop.run_in_executor(None, self.expense_tracker.summary_response)
+        if summary is None:
+            return HTTPStatus.SERVICE_UNAVAILABLE, self.json_body({'error': "Summary unavailable"}), {}
+
+        response_headers = {'ETag': summary['etag'], 'Cache-Control': 'no-cache'}
+        if summary['etag'] in headers.get('if-none-match', ''):
+            return HTTPStatus.NOT_MODIFIED, b'', response_headers
+        response_headers['Content-Type'] = 'application/json'
+        response_headers['Vary'] = 'Accept-Encoding'
+        if 'gzip' in headers.get('accept-encoding', ''):
+            response_headers['Content-Encoding'] = 'gzip'
+            return HTTPStatus.OK, summary['gzip_body'], response_headers
+        return HTTPStatus.OK, summary['body'], response_headers
+
+    def get_changes(self, query):
+        """Serve the changes since ?since=N for the run identified by ?epoch="""
+        try:
+            version = int(query['since'][0])
+        except (KeyError, ValueError):
+            return HTTPStatus.BAD_REQUEST, self.json_body({'error': "since must be a version number"}), {}
+        epoch = query.get('epoch', [self.expense_tracker.summary_engine.epoch])[0]
+        response = self.expense_tracker.changes_since(epoch, version)
+        return HTTPStatus.OK, self.json_body(response), {'Cache-Control': 'no-cache'}
+
+    async def post_expenses(self, body):
+        """Validate and save posted expenses straight through the ingest pipeline"""
+        try:
+            expense_data = json.loads(body)
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, self.json_body({'error': "Body is not valid JSON"}), {}
+
+        is_batch = isinstance(expense_data, list)
+        batch = expense_data if is_batch else [expense_data]
+        if self.async_tracker:
+            results = await self.async_tracker.add_expenses(batch)
+        else:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(None, self.expense_tracker.add_expenses, batch)
+        results = [{'saved': is_valid, 'message': message} for is_valid, message in results]
+
+        if is_batch:
+            return HTTPStatus.OK, self.json_body({'results': results}), {}
+        result = results[0]
+        if not result['saved']:
+            return HTTPStatus.UNPROCESSABLE_ENTITY, self.json_body(result), {}
+        # Spooled expenses are accepted but not yet in the database
+        status = HTTPStatus.ACCEPTED if result['message'] == SPOOLED else HTTPStatus.CREATED
+        return status, self.json_body(result), {}
+
+    async def stream_events(self, writer, last_event_id=None):
+        """Send the current totals, then every change as it happens
+        
+        'expense' events carry the new expense and the totals it changed, 'totals'
+        events replace every total after a reconcile, 'archived' follows an archive
+        run and 'resync' asks the client to reload the whole summary. Event ids are
+        "epoch-version", so a reconnecting client is sent only what it missed.
+        """
+        expense_tracker = self.expense_tracker
+        summary_engine = expense_tracker.summary_engine
+        subscriber = expense_tracker.event_bus.subscribe()
+        _, events = subscriber
+        try:
+            head = (f"HTTP/1.1 {HTTPStatus.OK.value} {HTTPStatus.OK.phrase}\r\n"
+                    "Content-Type: text/event-stream\r\n"
+                    "Cache-Control: no-cache\r\n"
+                    "Connection: keep-alive\r\n\r\n")
+            writer.write(head.encode('latin-1'))
+            # Subscribed first, so nothing between this catch-up and the stream is lost
+            missed = None
+            if last_event_id:
+                epoch, _, version = last_event_id.partition('-')
+                if epoch == summary_engine.epoch and version.isdigit():
+                    missed = summary_engine.changes_since(int(version))
+            if missed is None:
+                catch_up = [('resync' if last_event_id else 'totals', summary_engine.snapshot())]
+            else:
+                catch_up = [(change['type'], change) for change in missed]
+            last_version = 0
+            for event_type, data in catch_up:
+                writer.write(self.format_event(event_type, data))
+                last_version = data['version']
+            await writer.drain()
+            while True:
+                try:
+                    event_type, data = await asyncio.wait_for(events.get(), self.heartbeat_interval)
+                    if data.get('version', last_version + 1) <= last_version:
+                        # Already sent while catching up
+                        continue
+                    last_version = data.get('version', last_version)
+                    writer.write(self.format_event(event_type, data))
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            expense_tracker.event_bus.unsubscribe(subscriber)
+
+    def format_event(self, event_type, data):
+        """Encode one server-sent event"""
+        event_id = f"id: {self.expense_tracker.summary_engine.epoch}-{data['version']}\n" if 'version' in data else ""
+        payload = json.dumps(data, separators=(',', ':'), default=json_default)
+        return f"event: {event_type}\n{event_id}data: {payload}\n\n".encode('utf-8')
+
+    def get_static_file(self, path):
+        """Serve the tracker's page, script or stylesheet from the working directory"""
+        file_name = os.path.basename(path) or self.INDEX_FILE
+        content_type = self.STATIC_TYPES.get(os.path.splitext(file_name)[1])
+        if content_type is None or path.rstrip('/') not in ('', f"/{file_name}"):
+            return HTTPStatus.NOT_FOUND, self.json_body({'error': "Not found"}), {}
+        try:
+            with open(file_name, 'rb') as static_file:
+                return HTTPStatus.OK, static_file.read(), {'Content-Type': content_type}
+        except OSError:
+            return HTTPStatus.NOT_FOUND, self.json_body({'error': "Not found"}), {}
+
+    def json_body(self, data):
+        return json.dumps(data, default=json_default).encode('utf-8')
+
+    async def send(self, writer, status, body, headers=None, close=False):
+        """Write one response"""
+        # No CORS headers: the page is served from this origin, and other origins are kept out
+        response_headers = {'Content-Length': str(len(body))}
+        if body and not (headers and 'Content-Type' in headers):
+            response_headers['Content-Type'] = 'application/json'
+        if headers:
+            response_headers.update(headers)
+        if close:
+            response_headers['Connection'] = 'close'
+        head = f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        head += ''.join(f"{name}: {value}\r\n" for name, value in response_headers.items())
+        writer.write(head.encode('latin-1') + b'\r\n' + body)
+        await writer.drain()
 
 def main():
     """Main function to run the expense tracker"""
+    parser = argparse.ArgumentParser(description="Expense tracker")
+    parser.add_argument('--skip-archive', action='store_true',
+                        help="do not archive old expenses at startup, only on the regular schedule")
+    parser.add_argument('--serve', action='store_true',
+                        help="also accept expenses and serve the summary over HTTP")
+    parser.add_argument('--host', default=os.getenv('HTTP_HOST', '127.0.0.1'), help="address to serve HTTP on")
+    parser.add_argument('--port', type=int, default=int(os.getenv('HTTP_PORT', '8080')), help="port to serve HTTP on")
+    parser.add_argument('--async-db', action='store_true',
+                        help="with --serve, use an asyncio database driver (ASYNC_DB_DRIVER) for HTTP requests")
+    args = parser.parse_args()
+    if args.async_db and not args.serve:
+        parser.error("--async-db needs --serve")
+
     # Initialize expense tracker
     tracker = ExpenseTracker()
+
+    # Archive in the background so new expenses are accepted immediately
+    archive_scheduler = ArchiveScheduler(tracker, tracker.archive_interval, tracker.archive_retention_days,
+                                         run_at_startup=not args.skip_archive)
+    async_tracker = None
+    if args.async_db:
+        # Archiving runs on the event loop instead
+        default_driver = 'aiosqlite' if tracker.storage_backend == 'sqlite' else 'aiomysql'
+        database = AsyncExpenseDatabase(os.getenv('ASYNC_DB_DRIVER', default_driver), int(os.getenv('DB_POOL_SIZE', '5')))
+        async_tracker = AsyncExpenseTracker(tracker, database, archive_at_startup=not args.skip_archive)
+    else:
+        archive_scheduler.start()
     
     # Set up file system observer for new expenses
     event_handler = NewExpenseHandler(tracker)
     file_observer = Observer()
     file_observer.schedule(event_handler, path='.', recursive=False)
     file_observer.start()
+    event_handler.recover_claimed_files('.')
 
     print("Expense tracker is running. Press Ctrl+C to exit.")
+    served = True
     try:
-        while True:
-            time.sleep(1)
+        if args.serve:
+            served = asyncio.run(ExpenseHttpServer(tracker, args.host, args.port, async_tracker).serve())
+        else:
+            while True:
+                time.sleep(1)
     except KeyboardInterrupt:
+        pass
+    finally:
+        # Also reached when the HTTP server could not start, so nothing is left running
         file_observer.stop()
-        if tracker.db_connection:
-            tracker.db_connection.close()
-    file_observer.join()
+        file_observer.join()
+        # Drain queued files before exiting
+        archive_scheduler.stop()
+        event_handler.shutdown()
+        tracker.close()
+    if not served:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,197 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from Expense_tracker_Ver_8a import (CompactExpenseStore, ExpenseTracker, expense_columns,
+                                    numpy, summarize_expense_columns)
+
+CATEGORIES = ['food', 'transport', 'entertainment', 'utilities', 'other']
+
+def make_expenses(count, seed=1):
+    """Generate synthetic expenses shaped like rows from the expenses table"""
+    generator = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            'id': expense_id,
+            'user_id': generator.randint(1, 50),
+            'amount': round(generator.uniform(1, 200), 2),
+            'category': generator.choice(CATEGORIES),
+            'description': f"expense {expense_id}",
+            'date': start + timedelta(minutes=generator.randint(0, 525600))
+        }
+        for expense_id in range(count, 0, -1)
+    ]
+
+@contextmanager
+def benchmark_tracker(work_dir, **settings):
+    """Start a tracker that keeps its spool and summary files in work_dir, and close it afterwards
+    
+    settings are extra environment variables for the tracker, which reads them when it starts.
+    """
+    saved_environment = dict(os.environ)
+    os.environ.update(EXPENSE_SNAPSHOT='0', EXPENSE_SPOOL_FILE=os.path.join(work_dir, 'expense_spool.log'),
+                      **settings)
+    try:
+        tracker = ExpenseTracker()
+        tracker.summary_file = os.path.join(work_dir, 'expense_summary.json')
+        try:
+            yield tracker
+        finally:
+            tracker.close()
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environment)
+
+def time_call(function, repeat):
+    """Return the best wall-clock time in milliseconds over several runs"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def benchmark_summary_engines(count, repeat, include_sql):
+    """Compare the SQL aggregate path with the in-memory summary engines"""
+    rows = make_expenses(count)
+    store = CompactExpenseStore()
+    store.extend(rows)
+    columns, category_names = expense_columns(store)
+
+    print(f"Summary engines over {count} expenses (best of {repeat})")
+    if numpy is not None:
+        print(f"  memory, numpy:          {time_call(lambda: summarize_expense_columns(columns, category_names), repeat):9.2f} ms")
+    else:
+        print("  memory, numpy:          skipped (numpy is not installed)")
+    print(f"  memory, python loop:    "
+          f"{time_call(lambda: summarize_expense_columns(columns, category_names, use_numpy=False), repeat):9.2f} ms")
+    print(f"  memory, from row dicts: "
+          f"{time_call(lambda: summarize_expense_columns(*expense_columns(rows)), repeat):9.2f} ms")
+
+    if include_sql:
+        # Aggregates whatever is in the configured database, not the synthetic rows
+        with tempfile.TemporaryDirectory() as work_dir, benchmark_tracker(work_dir) as tracker:
+            if tracker.db_pool:
+                print(f"  sql aggregate queries:  {time_call(tracker.reconcile_summary, repeat):9.2f} ms "
+                      f"({tracker.summary_engine.snapshot()['expense_count']} rows in MySQL)")
+
+def benchmark_prepared_statements(iterations, repeat):
+    """Compare plain and prepared cursors for the hot statements on the configured database"""
+    with tempfile.TemporaryDirectory() as work_dir, benchmark_tracker(work_dir) as tracker:
+        if not tracker.db_pool:
+            print("Prepared statements: skipped (no database connection)")
+            return
+        row = (1.0, tracker.category_cache.category_id('food'), 'benchmark', datetime.now(), None, None)
+
+        def run_inserts():
+            # Rolled back, so the benchmark leaves no rows behind
+            with tracker.database_connection() as connection:
+                connection.start_transaction()
+                for _ in range(iterations):
+                    with tracker.statement_cursor(connection, ExpenseTracker.INSERT_EXPENSE_QUERY) as cursor:
+                        cursor.execute(ExpenseTracker.INSERT_EXPENSE_QUERY, row)
+                connection.rollback()
+
+        def run_aggregates():
+            with tracker.database_connection() as connection:
+                for _ in range(iterations):
+                    with tracker.statement_cursor(connection, ExpenseTracker.CATEGORY_TOTALS_QUERY) as cursor:
+                        cursor.execute(ExpenseTracker.CATEGORY_TOTALS_QUERY)
+                        cursor.fetchall()
+
+        print(f"Hot statements, {iterations} executions (best of {repeat}, per statement)")
+        for prepared in (False, True):
+            tracker.prepared_statements = prepared
+            label = "prepared" if prepared else "plain"
+            print(f"  {label:8} INSERT:          {time_call(run_inserts, repeat) * 1000 / iterations:9.1f} us")
+            print(f"  {label:8} category totals: {time_call(run_aggregates, repeat) * 1000 / iterations:9.1f} us")
+
+def benchmark_validation(count, repeat):
+    """Measure batch validation throughput on records shaped like parsed JSON"""
+    with tempfile.TemporaryDirectory() as work_dir, benchmark_tracker(work_dir) as tracker:
+        records = [
+            {
+                'amount': str(expense['amount']) if expense['id'] % 2 else expense['amount'],
+                'category': expense['category'],
+                'description': expense['description'],
+                'date': expense['date'].isoformat() + 'Z',
+                'user_id': expense['user_id']
+            }
+            for expense in make_expenses(count)
+        ]
+        elapsed = time_call(lambda: tracker.validate_expenses(records), repeat)
+        print(f"Batch validation of {count} expenses (best of {repeat})")
+        print(f"  validate_expenses:      {elapsed:9.2f} ms ({count / elapsed * 1000:,.0f} records/s)")
+
+def benchmark_storage(count, batch_size, repeat, backends):
+    """Compare ingest, load and aggregate throughput across storage backends"""
+    run_tag = f"storage benchmark {time.time_ns()}"
+    records = [
+        {
+            'amount': expense['amount'],
+            'category': expense['category'],
+            # Unique per run so reruns against the same MySQL database are not rejected as duplicates
+            'description': f"{run_tag} {expense['id']}",
+            'date': expense['date'].isoformat(),
+            'user_id': expense['user_id']
+        }
+        for expense in make_expenses(count)
+    ]
+
+    print(f"Storage backends, {count} expenses in batches of {batch_size} (load and aggregate best of {repeat})")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for backend in backends:
+            with benchmark_tracker(work_dir, STORAGE_BACKEND=backend,
+                                   SQLITE_PATH=os.path.join(work_dir, 'benchmark.db')) as tracker:
+                if not tracker.db_pool:
+                    print(f"  {backend:7} skipped (no database connection)")
+                    continue
+
+                started = time.perf_counter()
+                for start in range(0, count, batch_size):
+                    tracker.add_expenses(records[start:start + batch_size])
+                elapsed = (time.perf_counter() - started) * 1000
+                print(f"  {backend:7} add_expenses:      {elapsed:9.2f} ms ({count / elapsed * 1000:,.0f} records/s)")
+                print(f"  {backend:7} load_expenses:     {time_call(tracker.load_expenses, repeat):9.2f} ms "
+                      f"({len(tracker.expense_list)} rows)")
+                print(f"  {backend:7} reconcile_summary: {time_call(tracker.reconcile_summary, repeat):9.2f} ms")
+
+                # The SQLite file goes with the temporary directory; remove the rows added to MySQL
+                if backend != 'sqlite':
+                    with tracker.database_connection() as connection:
+                        cursor = connection.cursor()
+                        cursor.execute("DELETE FROM expenses WHERE description LIKE %s", (f"{run_tag} %",))
+                        connection.commit()
+                        cursor.close()
+
+def main():
+    """Run the selected benchmarks"""
+    parser = argparse.ArgumentParser(description="Expense tracker micro-benchmarks")
+    parser.add_argument('--count', type=int, default=100000, help="number of synthetic expenses")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per measurement")
+    parser.add_argument('--sql', action='store_true', help="also time the MySQL aggregate queries")
+    parser.add_argument('--prepared', action='store_true',
+                        help="time plain against prepared cursors on the configured database")
+    parser.add_argument('--iterations', type=int, default=1000, help="statement executions per prepared run")
+    parser.add_argument('--validation', action='store_true', help="time batch validation")
+    parser.add_argument('--storage', default='',
+                        help="comma-separated storage backends to compare, e.g. sqlite,mysql")
+    parser.add_argument('--batch-size', type=int, default=100, help="expenses per add_expenses call")
+    args = parser.parse_args()
+
+    benchmark_summary_engines(args.count, args.repeat, args.sql)
+    if args.validation:
+        benchmark_validation(args.count, args.repeat)
+    if args.prepared:
+        benchmark_prepared_statements(args.iterations, args.repeat)
+    if args.storage:
+        benchmark_storage(args.count, args.batch_size, args.repeat, args.storage.split(','))
+
+if __name__ == "__main__":
+    main()
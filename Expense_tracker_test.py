@@ -0,0 +1,459 @@
+import asyncio
+import json
+import os
+import pickle
+import sqlite3
+from http import HTTPStatus
+
+import pytest
+
+from Expense_tracker_Ver_8a import (SPOOLED, VALIDATION_ERRORS, AsyncExpenseDatabase, AsyncExpenseTracker,
+                                    ExpenseHttpServer, ExpenseTracker, NewExpenseHandler, aiosqlite,
+                                    assign_batch_ids, iter_json_records)
+
+EXPENSE = {'amount': 12.5, 'category': 'food', 'description': 'lunch', 'date': '2025-03-01T12:00:00Z'}
+DUPLICATE = (False, VALIDATION_ERRORS['duplicate'])
+
+@pytest.fixture
+def database_path(tmp_path, monkeypatch):
+    """Run each tracker on its own SQLite file, with its snapshot and spool in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'expense_tracker.db'
+    monkeypatch.delenv('EXPENSE_SNAPSHOT_FILE', raising=False)
+    monkeypatch.setenv('EXPENSE_STATE_DIR', str(tmp_path / 'state'))
+    monkeypatch.setenv('STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setenv('SQLITE_PATH', str(path))
+    monkeypatch.setenv('SUMMARY_INTERVAL', '0')
+    # The tests replay the spool themselves instead of waiting for the flusher
+    monkeypatch.setenv('SPOOL_FLUSH_INTERVAL', '3600')
+    monkeypatch.setenv('DB_RETRY_DELAY', '0')
+    monkeypatch.setenv('ARCHIVE_BATCH_PAUSE', '0')
+    return path
+
+@pytest.fixture
+def start_tracker(database_path):
+    """Start trackers on demand and close them all afterwards; closing twice is harmless"""
+    trackers = []
+
+    def start():
+        tracker = ExpenseTracker()
+        assert tracker.db_pool, "the SQLite database did not open"
+        trackers.append(tracker)
+        return tracker
+
+    yield start
+    for tracker in trackers:
+        tracker.close()
+
+def stored_rows(database_path):
+    """Read (id, amount, description) for every saved expense straight from the database file"""
+    with sqlite3.connect(database_path) as connection:
+        return connection.execute("SELECT id, amount, description FROM expenses ORDER BY id").fetchall()
+
+def expense(**fields):
+    return dict(EXPENSE, **fields)
+
+def test_sqlite_commits_are_synced_by_default(start_tracker):
+    connection = start_tracker().db_pool.get_connection()
+    try:
+        # 2 is FULL: every commit is on disk before it is acknowledged
+        assert connection.connection.execute("PRAGMA synchronous").fetchone()[0] == 2
+    finally:
+        connection.close()
+
+def test_validation_error_codes(start_tracker):
+    tracker = start_tracker()
+    batch = [
+        expense(amount='12.50', user_id='7'),
+        expense(amount=-1),
+        expense(amount=True),
+        expense(amount='nan'),
+        {key: value for key, value in EXPENSE.items() if key != 'amount'},
+        expense(category='holidays'),
+        expense(category=['food']),
+        expense(description='   '),
+        expense(date='yesterday'),
+        expense(user_id=-3),
+        'not an expense'
+    ]
+    records, error_codes = tracker.validate_expenses(batch)
+    assert error_codes == [None, 'invalid_amount', 'invalid_amount', 'invalid_amount', 'missing_amount',
+                           'invalid_category', 'invalid_category', 'empty_description', 'invalid_date',
+                           'invalid_user_id', 'not_an_object']
+    assert records[0]['amount'] == 12.5
+    assert records[0]['user_id'] == 7
+    assert records[1:] == [None] * (len(batch) - 1)
+
+def test_batch_save_gives_each_expense_its_row_id(start_tracker, database_path):
+    tracker = start_tracker()
+    results = tracker.add_expenses([expense(description=f"expense {number}") for number in range(3)])
+
+    assert results == [(True, "")] * 3
+    rows = stored_rows(database_path)
+    assert [row[2] for row in rows] == ['expense 0', 'expense 1', 'expense 2']
+    # Newest first, with the ids the database gave them
+    assert [(item['id'], item['description']) for item in tracker.expense_list] == \
+        [(row[0], row[2]) for row in reversed(rows)]
+    totals = tracker.summary_engine.snapshot()
+    assert totals['expense_count'] == 3
+    assert totals['total_amount'] == pytest.approx(37.5)
+
+def test_batch_ids_are_read_back_by_dedup_key(start_tracker, database_path):
+    tracker = start_tracker()
+    batch = [expense(client_id=f"b{number}", description=f"expense {number}") for number in range(3)]
+
+    assert tracker.add_expenses(batch) == [(True, "")] * 3
+    assert sorted((item['id'], item['description']) for item in tracker.expense_list) == \
+        [(row[0], row[2]) for row in stored_rows(database_path)]
+
+def test_batch_ids_without_dedup_keys_follow_the_auto_increment_step():
+    batch = [{}, {}, {}]
+    assign_batch_ids(batch, 11, id_step=2)
+    assert [expense_data['id'] for expense_data in batch] == [11, 13, 15]
+
+def test_duplicate_in_batch_falls_back_to_row_by_row(start_tracker, database_path):
+    tracker = start_tracker()
+    assert tracker.add_expenses([expense(client_id='c1')]) == [(True, "")]
+    # Forget the key so the unique index, not the cache, has to catch the duplicate
+    tracker.dedup_cache.keys.clear()
+
+    results = tracker.add_expenses([expense(client_id='c2'), expense(client_id='c1'), expense(client_id='c3')])
+
+    assert results == [(True, ""), DUPLICATE, (True, "")]
+    rows = stored_rows(database_path)
+    assert len(rows) == 3
+    assert sorted(item['id'] for item in tracker.expense_list) == [row[0] for row in rows]
+    assert tracker.summary_engine.snapshot()['expense_count'] == 3
+
+def test_repeated_expenses_are_rejected(start_tracker, database_path):
+    tracker = start_tracker()
+    results = tracker.add_expenses([expense(client_id='x1'), expense(client_id='x1', amount=5),
+                                    expense(), expense(), expense(), expense()],
+                                   [None, None, None, None, 'file#1', 'file#1'])
+
+    # Identical expenses are only repeats when they share a client_id or a source record
+    assert results == [(True, ""), DUPLICATE, (True, ""), (True, ""), (True, ""), DUPLICATE]
+    assert len(stored_rows(database_path)) == 4
+
+def test_client_id_resent_with_another_date_is_rejected(start_tracker):
+    tracker = start_tracker()
+    assert tracker.add_expenses([expense(client_id='r1')]) == [(True, "")]
+    tracker.dedup_cache.keys.clear()
+
+    assert tracker.add_expenses([expense(client_id='r1', date='2025-03-02T09:00:00Z')]) == [DUPLICATE]
+
+def test_dedup_keys_survive_a_restart(start_tracker):
+    start_tracker().add_expenses([expense(client_id='k1')])
+    assert start_tracker().add_expenses([expense(client_id='k1')]) == [DUPLICATE]
+
+def test_spooled_expenses_are_replayed_once_the_database_is_back(start_tracker, database_path):
+    tracker = start_tracker()
+    tracker.db_pool = None
+
+    results = tracker.add_expenses([expense(description='first'), expense(description='second')])
+
+    assert results == [(True, SPOOLED)] * 2
+    assert tracker.spool.has_backlog()
+    assert tracker.summary_engine.snapshot()['expense_count'] == 0
+    assert stored_rows(database_path) == []
+
+    tracker.spool.replay()
+
+    assert not tracker.spool.has_backlog()
+    assert [row[2] for row in stored_rows(database_path)] == ['first', 'second']
+    assert tracker.summary_engine.snapshot()['expense_count'] == 2
+    assert tracker.add_expenses([expense(description='third')]) == [(True, "")]
+
+def test_tracker_reconnects_without_a_spool(tmp_path, database_path, monkeypatch):
+    monkeypatch.setenv('EXPENSE_SPOOL', '0')
+    monkeypatch.setenv('DB_RECONNECT_INTERVAL', '0.05')
+    # The database file cannot be opened until its folder exists
+    monkeypatch.setenv('SQLITE_PATH', str(tmp_path / 'later' / 'expense_tracker.db'))
+    tracker = ExpenseTracker()
+    try:
+        assert tracker.db_pool is None
+        (tmp_path / 'later').mkdir()
+        tracker.reconnector.thread.join(timeout=10)
+
+        assert tracker.db_pool
+        assert os.path.exists(tmp_path / 'expense_summary.json')
+        assert tracker.add_expenses([expense()]) == [(True, "")]
+    finally:
+        tracker.close()
+
+@pytest.mark.parametrize('expense_store', ['dict', 'compact'])
+def test_snapshot_restores_expenses_and_loads_newer_rows(start_tracker, database_path, monkeypatch, expense_store):
+    monkeypatch.setenv('EXPENSE_STORE', expense_store)
+    tracker = start_tracker()
+    tracker.add_expenses([expense(description='before', amount=1)])
+    tracker.close()
+    with sqlite3.connect(database_path) as connection:
+        # Changed behind the snapshot's back, so a reload from the table would show 99
+        connection.execute("UPDATE expenses SET amount = 99")
+        connection.execute("INSERT INTO expenses (amount, category_id, description, date) "
+                           "SELECT 2, category_id, 'after', date FROM expenses")
+
+    restarted = start_tracker()
+
+    assert [(item['description'], item['amount']) for item in restarted.expense_list] == \
+        [('after', 2.0), ('before', 1.0)]
+    assert restarted.summary_engine.snapshot()['expense_count'] == 2
+    # Kept out of the working directory, which the watcher ingests from
+    assert os.path.dirname(restarted.snapshot_file) == str(database_path.parent / 'state')
+    assert not [name for name in os.listdir(database_path.parent) if 'snapshot' in name]
+
+class PlantedPayload:
+    def __reduce__(self):
+        return (open, ('planted_code_ran', 'w'))
+
+def test_planted_pickle_snapshot_is_never_unpickled(start_tracker, database_path):
+    tracker = start_tracker()
+    tracker.add_expenses([expense()])
+    tracker.close()
+    with open(tracker.snapshot_file, 'wb') as snapshot:
+        pickle.dump({'version': 2, 'expenses': PlantedPayload()}, snapshot)
+
+    restarted = start_tracker()
+
+    assert not os.path.exists('planted_code_ran')
+    assert [item['description'] for item in restarted.expense_list] == ['lunch']
+
+def test_snapshot_is_ignored_when_the_database_was_recreated(start_tracker, database_path):
+    tracker = start_tracker()
+    tracker.add_expenses([expense()])
+    tracker.close()
+    with sqlite3.connect(database_path) as connection:
+        connection.execute("DELETE FROM expenses")
+
+    assert len(start_tracker().expense_list) == 0
+
+@pytest.mark.parametrize('expense_store', ['dict', 'compact'])
+def test_summary_dates_carry_their_utc_offset(start_tracker, database_path, monkeypatch, expense_store):
+    monkeypatch.setenv('EXPENSE_STORE', expense_store)
+    tracker = start_tracker()
+    tracker.add_expenses([expense(date='2025-03-01T14:00:00+02:00')])
+
+    with sqlite3.connect(database_path) as connection:
+        assert connection.execute("SELECT date FROM expenses").fetchone()[0] == '2025-03-01 12:00:00'
+    summary_path = database_path.parent / 'expense_summary.json'
+    assert json.loads(summary_path.read_text())['expenses'][0]['date'] == '2025-03-01T12:00:00+00:00'
+    # And again once the expense is read back from the database
+    tracker.close()
+    os.remove(summary_path)
+    start_tracker().update_summary()
+    assert json.loads(summary_path.read_text())['expenses'][0]['date'] == '2025-03-01T12:00:00+00:00'
+
+def test_changes_since(start_tracker):
+    tracker = start_tracker()
+    totals = tracker.summary_engine.snapshot()
+    epoch, version = totals['epoch'], totals['version']
+
+    assert tracker.changes_since(epoch, version) == {'epoch': epoch, 'version': version, 'changes': []}
+
+    tracker.add_expenses([expense(description='coffee', amount=3)])
+    response = tracker.changes_since(epoch, version)
+
+    assert response['version'] == version + 1
+    change, = response['changes']
+    assert change['type'] == 'expense'
+    assert change['expense']['description'] == 'coffee'
+    assert change['category_totals'] == {'food': 3.0}
+    assert tracker.changes_since(epoch, response['version'])['changes'] == []
+    # A client from another run, or one ahead of the log, has to reload the summary
+    assert tracker.changes_since('other-epoch', version)['reset']
+    assert tracker.changes_since(epoch, response['version'] + 5)['reset']
+
+def test_changes_since_resets_once_the_log_has_moved_on(start_tracker, monkeypatch):
+    monkeypatch.setenv('SUMMARY_CHANGE_LOG_SIZE', '2')
+    tracker = start_tracker()
+    totals = tracker.summary_engine.snapshot()
+    tracker.add_expenses([expense(description=f"expense {number}") for number in range(3)])
+
+    assert tracker.changes_since(totals['epoch'], totals['version'])['reset']
+    assert len(tracker.changes_since(totals['epoch'], totals['version'] + 1)['changes']) == 2
+
+def test_archiving_into_a_table_that_already_holds_rows(start_tracker, database_path):
+    tracker = start_tracker()
+    tracker.add_expenses([expense(description='old', date='2020-01-01'), expense(description='new')])
+    with sqlite3.connect(database_path) as connection:
+        # Rows archived by an earlier version, numbered by the table and with no expense_id
+        connection.executemany("INSERT INTO archived_expenses (amount, category_id, description, date) "
+                               "VALUES (1, 1, ?, '2019-01-01')", [('earlier 1',), ('earlier 2',)])
+    old_id = next(item['id'] for item in tracker.expense_list if item['description'] == 'old')
+
+    assert tracker.archive_old_expenses('2021-01-01') == 1
+    assert tracker.archive_old_expenses('2021-01-01') == 0
+
+    assert [row[2] for row in stored_rows(database_path)] == ['new']
+    assert [item['description'] for item in tracker.expense_list] == ['new']
+    with sqlite3.connect(database_path) as connection:
+        archived = connection.execute("SELECT expense_id, description FROM archived_expenses ORDER BY id").fetchall()
+    assert archived == [(None, 'earlier 1'), (None, 'earlier 2'), (old_id, 'old')]
+
+def test_interrupted_archive_batch_is_not_copied_twice(start_tracker, database_path):
+    tracker = start_tracker()
+    tracker.add_expenses([expense(description='old', date='2020-01-01')])
+    with sqlite3.connect(database_path) as connection:
+        # Copied, but the run stopped before the row was deleted from expenses
+        connection.execute("INSERT INTO archived_expenses (expense_id, amount, category_id, description, date) "
+                           "SELECT id, amount, category_id, description, date FROM expenses")
+
+    assert tracker.archive_old_expenses('2021-01-01') == 1
+
+    assert stored_rows(database_path) == []
+    with sqlite3.connect(database_path) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM archived_expenses").fetchone() == (1,)
+
+def test_archived_expense_ids_move_to_their_own_column(database_path, start_tracker):
+    with sqlite3.connect(database_path) as connection:
+        # A file from before expense_id, when archived rows kept the expense id in id
+        connection.execute("""CREATE TABLE archived_expenses (id INTEGER PRIMARY KEY, amount DECIMAL(10, 2) NOT NULL,
+                              category_id INTEGER NOT NULL, description VARCHAR(255) NOT NULL,
+                              date DATETIME NOT NULL, user_id INTEGER)""")
+        connection.execute("INSERT INTO archived_expenses VALUES (7, 1, 1, 'archived', '2019-01-01', NULL)")
+
+    start_tracker()
+
+    with sqlite3.connect(database_path) as connection:
+        assert connection.execute("SELECT id, expense_id FROM archived_expenses").fetchall() == [(7, 7)]
+
+RECORDS = [expense(description=f"expense {number}", amount=number + 1) for number in range(20)]
+
+@pytest.mark.parametrize('layout', ['array', 'ndjson', 'object'])
+@pytest.mark.parametrize('chunk_size', [7, 64, 65536])
+def test_json_records_split_across_chunks(tmp_path, layout, chunk_size):
+    path = tmp_path / 'new_expenses.json'
+    if layout == 'array':
+        path.write_text(json.dumps(RECORDS, indent=2))
+        expected = RECORDS
+    elif layout == 'ndjson':
+        path.write_text(''.join(json.dumps(record) + '\n' for record in RECORDS))
+        expected = RECORDS
+    else:
+        path.write_text(json.dumps(RECORDS[0], indent=2))
+        expected = RECORDS[:1]
+
+    assert list(iter_json_records(path, chunk_size)) == [(record, None) for record in expected]
+
+def test_bad_ndjson_line_is_reported_and_the_rest_still_read(tmp_path):
+    path = tmp_path / 'expenses.ndjson'
+    lines = [json.dumps(record) for record in RECORDS[:3]]
+    lines[1] = '{"amount": 1, oops}'
+    path.write_text('\n'.join(lines) + '\n')
+
+    results = list(iter_json_records(path, chunk_size=16))
+
+    assert [record for record, _ in results] == [RECORDS[0], None, RECORDS[2]]
+    assert results[1][1].startswith("Invalid JSON")
+
+def test_bad_json_array_raises_without_reading_on(tmp_path):
+    path = tmp_path / 'new_expenses.json'
+    path.write_text('[' + json.dumps(RECORDS[0]) + ', {"amount": oops}, ' +
+                    ', '.join(json.dumps(record) for record in RECORDS[1:]) + ']')
+
+    records = iter_json_records(path, chunk_size=16)
+
+    assert next(records) == (RECORDS[0], None)
+    with pytest.raises(ValueError, match="record 2"):
+        next(records)
+
+def test_bulk_import_skips_bad_lines_and_sets_invalid_files_aside(start_tracker, database_path):
+    tracker = start_tracker()
+    handler = NewExpenseHandler(tracker)
+    good_lines = [json.dumps(record) for record in RECORDS[:3]]
+    (database_path.parent / 'expenses.ndjson').write_text('\n'.join([good_lines[0], '{oops', *good_lines[1:]]))
+    (database_path.parent / 'more_new_expenses.json').write_text('[' + json.dumps(RECORDS[3]) + ', {oops}]')
+    try:
+        handler.process_file(str(database_path.parent / 'expenses.ndjson'))
+        handler.process_file(str(database_path.parent / 'more_new_expenses.json'))
+    finally:
+        handler.shutdown()
+
+    assert [row[2] for row in stored_rows(database_path)] == [f"expense {number}" for number in range(4)]
+    leftovers = sorted(name for name in os.listdir(database_path.parent) if 'expenses' in name)
+    assert len(leftovers) == 1 and leftovers[0].startswith('more_new_expenses.json.')
+    assert leftovers[0].endswith('.rejected')
+
+def test_bulk_file_keeps_repeated_records_but_is_not_imported_twice(start_tracker, database_path):
+    tracker = start_tracker()
+    handler = NewExpenseHandler(tracker)
+    path = database_path.parent / 'expenses.ndjson'
+    path.write_text(json.dumps(EXPENSE) + '\n' + json.dumps(EXPENSE) + '\n')
+    claimed_path = handler.claim_path(str(path))
+    os.rename(path, claimed_path)
+    os.link(claimed_path, database_path.parent / 'copy')
+    try:
+        handler.process_claimed_file(str(path), claimed_path)
+        # The same file again, as after a crash before it was removed
+        os.rename(database_path.parent / 'copy', claimed_path)
+        handler.process_claimed_file(str(path), claimed_path)
+    finally:
+        handler.shutdown()
+
+    assert len(stored_rows(database_path)) == 2
+
+def test_save_cancelled_while_waiting_for_a_reconcile_leaves_the_gate_open(start_tracker):
+    tracker = start_tracker()
+    summary_engine = tracker.summary_engine
+
+    async def cancel_while_waiting():
+        async_tracker = AsyncExpenseTracker(tracker, AsyncExpenseDatabase('aiosqlite', 1), archive_at_startup=False)
+        summary_engine.begin_reconcile()
+        task = asyncio.create_task(async_tracker.add_expenses([expense()]))
+        while not summary_engine.waiting_writers:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        summary_engine.end_reconcile()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The worker thread takes the gate after the task is gone and has to give it back
+        for _ in range(500):
+            if not summary_engine.writers and not summary_engine.waiting_writers:
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(cancel_while_waiting())
+
+    assert summary_engine.writers == 0
+    assert tracker.reconcile_summary()
+
+@pytest.mark.skipif(aiosqlite is None, reason="aiosqlite is not installed")
+def test_async_add_expenses(start_tracker, database_path):
+    tracker = start_tracker()
+
+    async def add():
+        async_tracker = AsyncExpenseTracker(tracker, AsyncExpenseDatabase('aiosqlite', 2), archive_at_startup=False)
+        assert await async_tracker.connect()
+        try:
+            results = await async_tracker.add_expenses([expense(client_id='a1'), expense(client_id='a2')])
+            results += await async_tracker.add_expenses([expense(client_id='a1'), expense(amount=0)])
+            assert await async_tracker.reconcile_summary()
+        finally:
+            await async_tracker.close()
+        return results
+
+    results = asyncio.run(add())
+
+    assert results == [(True, ""), (True, ""), DUPLICATE, (False, VALIDATION_ERRORS['invalid_amount'])]
+    rows = stored_rows(database_path)
+    assert sorted(item['id'] for item in tracker.expense_list) == [row[0] for row in rows]
+    assert tracker.summary_engine.snapshot()['expense_count'] == 2
+
+def read_request_head(head):
+    """Parse a request head the way the HTTP server reads it off a connection"""
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(head)
+        reader.feed_eof()
+        return await ExpenseHttpServer(None, 'localhost', 0).read_request(reader)
+    return asyncio.run(read())
+
+def test_request_heads_over_the_limits_are_refused():
+    headers = b''.join(b'X-Header-%d: 1\r\n' % number for number in range(100))
+
+    assert read_request_head(b'GET /summary HTTP/1.1\r\n' + headers + b'\r\n')[1] == '/summary'
+    assert read_request_head(b'GET /summary HTTP/1.1\r\n' + headers + b'X-One-Too-Many: 1\r\n\r\n') == \
+        HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE
+    assert read_request_head(b'GET /summary HTTP/1.1\r\nCookie: ' + b'a' * 70000 + b'\r\n\r\n') == \
+        HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE
+    assert read_request_head(b'GET /' + b'a' * 70000 + b' HTTP/1.1\r\n\r\n') == HTTPStatus.REQUEST_URI_TOO_LONG